@@ -0,0 +1,12 @@
+{#- On incremental runs: only rows on or after the target's latest ds minus var('lookback_days'),
+    so late-arriving events for recent days are rebuilt. On full refreshes: every row. -#}
+{% macro incremental_window(date_col, ds_col='ds') -%}
+  {%- if is_incremental() -%}
+    {{ date_col }} >= (
+      select cast({{ dbt.dateadd('day', -1 * var('lookback_days'), 'max(' ~ ds_col ~ ')') }} as date)
+      from {{ this }}
+    )
+  {%- else -%}
+    true
+  {%- endif -%}
+{%- endmacro %}
@@ -1,35 +1,51 @@
-with listens as (
+{{
+  config(
+    materialized='incremental',
+    unique_key='ds',
+    incremental_strategy='delete+insert',
+    on_schema_change='fail'
+  )
+}}
+
+-- one keyed stream of (ds, creator_id) contributions aggregated once, instead of FULL JOINs on
+-- coalesced keys; incremental runs rebuild whole days inside the lookback window
+with contributions as (
   select
     event_date as ds,
     creator_id,
-    sum(listens) as listens
+    0 as episodes_published,
+    listens,
+    0.0 as revenue_usd
   from {{ ref('stg_listening_events') }}
-  group by 1,2
-),
-revenue as (
+  where {{ incremental_window('event_date') }}
+
+  union all
+
   select
     event_date as ds,
     creator_id,
-    sum(revenue_usd) as revenue_usd
+    0 as episodes_published,
+    0 as listens,
+    revenue_usd
   from {{ ref('stg_revenue_events') }}
-  group by 1,2
-),
-episodes as (
+  where {{ incremental_window('event_date') }}
+
+  union all
+
   select
     published_date as ds,
     creator_id,
-    count(*) as episodes_published
+    1 as episodes_published,
+    0 as listens,
+    0.0 as revenue_usd
   from {{ ref('stg_episodes') }}
-  group by 1,2
+  where {{ incremental_window('published_date') }}
 )
 select
-  coalesce(l.ds, r.ds, e.ds) as ds,
-  coalesce(l.creator_id, r.creator_id, e.creator_id) as creator_id,
-  coalesce(episodes_published, 0) as episodes_published,
-  coalesce(listens, 0) as listens,
-  coalesce(revenue_usd, 0.0) as revenue_usd
-from listens l
-full join revenue r
-  on l.ds=r.ds and l.creator_id=r.creator_id
-full join episodes e
-  on coalesce(l.ds,r.ds)=e.ds and coalesce(l.creator_id,r.creator_id)=e.creator_id
+  ds,
+  creator_id,
+  sum(episodes_published) as episodes_published,
+  sum(listens) as listens,
+  sum(revenue_usd) as revenue_usd
+from contributions
+group by 1,2
@@ -1,3 +1,12 @@
+{{
+  config(
+    materialized='incremental',
+    unique_key='ds',
+    incremental_strategy='delete+insert',
+    on_schema_change='fail'
+  )
+}}
+
 with daily as (
   select
     ds,
@@ -6,6 +15,7 @@ with daily as (
     sum(revenue_usd) as revenue_usd,
     sum(episodes_published) as episodes_published
   from {{ ref('fct_creator_daily') }}
+  where {{ incremental_window('ds') }}
   group by 1
 ),
 funnel as (
@@ -22,7 +32,8 @@ select
   d.revenue_usd,
   round(d.revenue_usd/nullif(d.active_creators,0), 4) as revenue_per_active_creator,
   d.episodes_published,
-  -- funnel snapshot fields repeated daily for simple dashboard joins (ok for portfolio)
+  -- funnel snapshot fields repeated daily for simple dashboard joins (ok for portfolio);
+  -- incremental runs stamp the snapshot onto the days they (re)build
   f.eligible_creators,
   f.enrolled_creators,
   round(f.enrolled_creators*1.0/nullif(f.eligible_creators,0), 4) as enroll_rate_given_eligible,
@@ -1 +1 @@
-from . import funnel, ab_test, monitoring
+from . import funnel, ab_test, monitoring, experiments, active_creators, cube
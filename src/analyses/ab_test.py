@@ -2,7 +2,10 @@ from __future__ import annotations
 from pathlib import Path
 import numpy as np
 import pandas as pd
-from src.utils.db import connect, read_df
+from scipy import stats
+from src.utils import sampling
+from src.utils.db import maybe_connect, read_df
+from src.utils.trace import traced
 from src.utils.stats import diff_in_proportions
 
 AB_SQL = r"""
@@ -23,10 +26,55 @@ FROM eligible
 GROUP BY 1;
 """
 
-def run(db_path: str, out_dir: Path):
-    con = connect(db_path)
-    df = read_df(con, AB_SQL)
+COUNTS = ["n_creators", "n_eligible", "n_enrolled_given_eligible"]
+
+# the same counts per stratum of a sample schema
+AB_SAMPLED_SQL = r"""
+SELECT
+  experiment_group::VARCHAR AS experiment_group,
+  tier::VARCHAR AS tier,
+  country::VARCHAR AS country,
+  count(*) AS n_creators,
+  sum(eligible) AS n_eligible,
+  sum(CASE WHEN eligible=1 AND enrolled=1 THEN 1 ELSE 0 END) AS n_enrolled_given_eligible
+FROM {schema}.raw_creators
+GROUP BY ALL
+"""
+
+def run_sampled(con, out_dir: Path, rate: float):
+    """Counts scaled up from the stratified sample (95% CIs) and the enrollment effect with a stratified CI."""
+    schema = sampling.require(con, rate)
+    fine = read_df(con, AB_SAMPLED_SQL.format(schema=schema), name="ab_test_sampled")
+    strata = sampling.strata(con, schema)
+    by = ["experiment_group"]
+
+    counts = sampling.estimate(fine, strata, by, {m: (m, None) for m in COUNTS}, digits={m: 0 for m in COUNTS})
+    counts.to_csv(out_dir / "ab_summary_counts.csv", index=False)
+
+    # the effect is about creators in general, not this warehouse's creators: no finite population correction
+    rates = sampling.estimate(fine, strata, by, ratios={"rate": ("n_enrolled_given_eligible", "n_eligible", None, None, None)},
+                              fpc=False, se=True).set_index("experiment_group")
+    ctrl, trt = rates.loc["control"], rates.loc["treatment"]
+    diff = trt["rate"] - ctrl["rate"]
+    half = stats.norm.ppf(0.975) * np.sqrt(ctrl["rate_se"] ** 2 + trt["rate_se"] ** 2)
+    out = pd.DataFrame([{
+        "metric": "enroll_rate_given_eligible",
+        "control_rate": round(float(ctrl["rate"]), 6),
+        "treatment_rate": round(float(trt["rate"]), 6),
+        "diff_treat_minus_control": round(float(diff), 6),
+        "ci95_low": round(float(diff - half), 6),
+        "ci95_high": round(float(diff + half), 6),
+        "sample_rate": rate,
+    }])
+    out.to_csv(out_dir / "ab_effect_estimate.csv", index=False)
+
+@traced("ab_test.run")
+def run(db_path: str, out_dir: Path, con=None, sample: float | None = None):
     out_dir.mkdir(parents=True, exist_ok=True)
+    with maybe_connect(db_path, con) as con:
+        if sample:
+            return run_sampled(con, out_dir, sample)
+        df = read_df(con, AB_SQL, name="ab_test")
     df.to_csv(out_dir / "ab_summary_counts.csv", index=False)
 
     # Compute enrollment rate among eligible (primary metric)
@@ -46,4 +94,3 @@ def run(db_path: str, out_dir: Path):
         "ci95_high": round(float(hi), 6),
     }])
     out.to_csv(out_dir / "ab_effect_estimate.csv", index=False)
-    con.close()
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from pathlib import Path
+from src.utils.db import export, exec_sql, maybe_connect, record_build, sql_filters, stale_days, table_exists, table_signature
+from src.utils.trace import traced
+
+DIMENSIONS = ["tier", "country", "category", "experiment_group"]
+# every measure is additive over any dimension: a creator falls in exactly one cell per day
+MEASURES = ["active_creators", "listens", "revenue_usd", "episodes_published"]
+
+CUBE_TABLE = "kpi_cube"
+SOURCE_TABLES = ["raw_listening_events", "raw_revenue_events", "raw_episodes"]
+DIM_TABLES = ["raw_creators", "raw_podcasts"]
+
+# coarser aggregates materialized from the base cube (day grain always kept)
+ROLLUPS = [
+    (),
+    ("tier",),
+    ("experiment_group",),
+    ("tier", "experiment_group"),
+    ("country",),
+    ("category",),
+]
+
+# day x tier x country x category x experiment_group. Per-creator daily contributions are unioned
+# and aggregated once (no joins between fact tables); category = category of the creator's first
+# podcast, as in the funnel; active = at least one listening event that day.
+CUBE_SQL = r"""
+WITH contributions AS (
+  SELECT event_date::DATE AS ds, creator_id, listens, 0.0 AS revenue_usd, 0 AS episodes, true AS listened
+  FROM raw_listening_events
+  WHERE {where_listens}
+  UNION ALL
+  SELECT event_date::DATE, creator_id, 0, revenue_usd, 0, false
+  FROM raw_revenue_events
+  WHERE {where_revenue}
+  UNION ALL
+  SELECT published_at::DATE, creator_id, 0, 0.0, 1, false
+  FROM raw_episodes
+  WHERE {where_episodes}
+),
+daily AS (
+  SELECT ds, creator_id, sum(listens) AS listens, sum(revenue_usd) AS revenue_usd,
+    sum(episodes) AS episodes, bool_or(listened) AS active
+  FROM contributions
+  GROUP BY ALL
+),
+first_podcast AS (
+  SELECT creator_id, arg_min(category, podcast_id) AS category
+  FROM raw_podcasts
+  GROUP BY 1
+)
+SELECT
+  d.ds,
+  c.tier,
+  c.country,
+  p.category,
+  c.experiment_group,
+  count(*) FILTER (WHERE d.active) AS active_creators,
+  sum(d.listens)::BIGINT AS listens,
+  sum(d.revenue_usd) AS revenue_usd,
+  sum(d.episodes)::BIGINT AS episodes_published
+FROM daily d
+JOIN raw_creators c USING(creator_id)
+LEFT JOIN first_podcast p USING(creator_id)
+GROUP BY ALL
+"""
+
+def rollup_table(dims: tuple[str, ...]) -> str:
+    return CUBE_TABLE if set(dims) == set(DIMENSIONS) else f"{CUBE_TABLE}__{'_'.join(dims) or 'day'}"
+
+def cube_sql(days: list | None = None) -> str:
+    def where(col: str) -> str:
+        return f"{col}::DATE IN ({', '.join(f'DATE {d!r}' for d in map(str, days))})" if days else "true"
+    return CUBE_SQL.format(
+        where_listens=where("event_date"), where_revenue=where("event_date"), where_episodes=where("published_at")
+    )
+
+def rollup_sql(dims: tuple[str, ...], where: str = "true") -> str:
+    sums = ", ".join(f"sum({m}) AS {m}" for m in MEASURES)
+    return f"SELECT ds, {''.join(f'{d}, ' for d in dims)}{sums} FROM {CUBE_TABLE} WHERE {where} GROUP BY ALL"
+
+def build_cube(con) -> str:
+    """Refresh the base cube and its rollups after a load, recomputing only the (re)loaded days when possible."""
+    sig = ",".join([*(rollup_table(r) for r in ROLLUPS), *(table_signature(con, t) for t in DIM_TABLES)])
+    days = stale_days(con, CUBE_TABLE, SOURCE_TABLES, sig)
+
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        if days is None:
+            exec_sql(con, f"CREATE OR REPLACE TABLE {CUBE_TABLE} AS {cube_sql()} ORDER BY ds", name="build kpi_cube")
+            for r in ROLLUPS:
+                exec_sql(con, f"CREATE OR REPLACE TABLE {rollup_table(r)} AS {rollup_sql(r)} ORDER BY ds", name=f"build {rollup_table(r)}")
+        elif days:
+            in_days = f"ds IN ({', '.join(f'DATE {str(d)!r}' for d in days)})"
+            con.execute(f"DELETE FROM {CUBE_TABLE} WHERE {in_days};")
+            exec_sql(con, f"INSERT INTO {CUBE_TABLE} {cube_sql(days)}", name="build kpi_cube")
+            for r in ROLLUPS:
+                con.execute(f"DELETE FROM {rollup_table(r)} WHERE {in_days};")
+                exec_sql(con, f"INSERT INTO {rollup_table(r)} {rollup_sql(r, in_days)}", name=f"build {rollup_table(r)}")
+        # nothing reloaded leaves the build records (the tables' versions) untouched
+        if days != []:
+            for t in (CUBE_TABLE, *(rollup_table(r) for r in ROLLUPS)):
+                record_build(con, t, sig)
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    return CUBE_TABLE
+
+def ensure_cube(con) -> str:
+    """Use the warehouse's cube (refreshed by the loader) or build a connection-local base cube."""
+    if not table_exists(con, CUBE_TABLE):
+        exec_sql(con, f"CREATE OR REPLACE TEMP TABLE {CUBE_TABLE} AS {cube_sql()}", name="build kpi_cube")
+    return CUBE_TABLE
+
+def best_table(con, dims: tuple[str, ...] | list[str]) -> str:
+    """Smallest materialized aggregate that has every column in `dims`."""
+    bad = set(dims) - set(DIMENSIONS)
+    if bad:
+        raise ValueError(f"Unknown cube dimension(s) {sorted(bad)}; choose from {DIMENSIONS}")
+    ensure_cube(con)
+    candidates = [rollup_table(r) for r in ROLLUPS if set(dims) <= set(r)] + [CUBE_TABLE]
+    sizes = dict(con.execute(
+        f"SELECT table_name, estimated_size FROM duckdb_tables() WHERE schema_name = 'main' "
+        f"AND table_name IN ({', '.join('?' for _ in candidates)})",
+        candidates,
+    ).fetchall())
+    return min((t for t in candidates if t in sizes), key=lambda t: sizes[t])
+
+def query_sql(con, dims: tuple[str, ...] = (), filters: dict[str, str] | None = None) -> str:
+    """Daily measures by `dims` (optionally filtered on dimension values), from the smallest matching aggregate."""
+    filters = filters or {}
+    table = best_table(con, (*dims, *filters))
+    where = sql_filters(filters)
+    sums = ", ".join(f"sum({m}) AS {m}" for m in MEASURES)
+    return f"SELECT ds, {''.join(f'{d}, ' for d in dims)}{sums} FROM {table} WHERE {where} GROUP BY ALL ORDER BY ALL"
+
+@traced("cube.run")
+def run(db_path: str, out_dir: Path, con=None):
+    """Dashboard extracts: daily KPIs and the full-grain cube for segment filters."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with maybe_connect(db_path, con) as con:
+        export(con, query_sql(con), out_dir / "kpi_daily.csv", name="kpi_daily")
+        export(con, query_sql(con, tuple(DIMENSIONS)), out_dir / "kpi_cube.csv", name="kpi_cube")
@@ -0,0 +1,183 @@
+from __future__ import annotations
+from pathlib import Path
+import pandas as pd
+from src.utils.db import maybe_connect, read_df
+from src.utils.trace import span, traced
+from src.utils.stats import mean_var_from_sums, cov_from_sums, ratio_from_sums, diff_test, cuped_theta
+
+# experiment name -> SQL returning (creator_id, variant); every variant is compared to CONTROL
+EXPERIMENTS = {
+    "new_enrollment_banner": "SELECT creator_id, experiment_group::VARCHAR AS variant FROM raw_creators",
+}
+CONTROL = "control"
+
+# metric name -> unit-level expressions over UNITS_SQL columns:
+#   y: outcome, d: denominator (ratio-of-sums metric), x: pre-period covariate (CUPED), filter: unit filter
+METRICS = {
+    "enroll_rate_given_eligible": {"y": "enrolled", "filter": "eligible = 1"},
+    "first_payout_rate": {"y": "first_payout"},
+    "revenue_per_creator": {"y": "revenue", "x": "pre_revenue"},
+    "listens_per_creator": {"y": "listens", "x": "pre_listens"},
+    "episodes_per_creator": {"y": "episodes", "x": "pre_episodes"},
+    "revenue_per_1k_listens": {"y": "revenue", "d": "listens / 1000.0"},
+}
+
+SEGMENTS = ["tier", "country"]
+
+# one row per creator with post-period outcomes and pre-period covariates; the experiment start
+# defaults to the midpoint of the episode date range
+UNITS_SQL = r"""
+WITH start AS (
+  SELECT coalesce({start_date}, min(published_at) + CAST(date_diff('day', min(published_at), max(published_at)) / 2 AS INTEGER)) AS start_ds
+  FROM raw_episodes
+),
+l AS (
+  SELECT
+    creator_id,
+    sum(listens) FILTER (WHERE event_date >= s.start_ds) AS listens,
+    sum(listens) FILTER (WHERE event_date < s.start_ds) AS pre_listens
+  FROM raw_listening_events, start s
+  GROUP BY 1
+),
+r AS (
+  SELECT
+    creator_id,
+    sum(revenue_usd) FILTER (WHERE event_date >= s.start_ds) AS revenue,
+    sum(revenue_usd) FILTER (WHERE event_date < s.start_ds) AS pre_revenue
+  FROM raw_revenue_events, start s
+  GROUP BY 1
+),
+e AS (
+  SELECT
+    creator_id,
+    count(*) FILTER (WHERE published_at >= s.start_ds) AS episodes,
+    count(*) FILTER (WHERE published_at < s.start_ds) AS pre_episodes
+  FROM raw_episodes, start s
+  GROUP BY 1
+)
+SELECT
+  c.creator_id,
+  c.tier::VARCHAR AS tier,
+  c.country::VARCHAR AS country,
+  c.eligible,
+  c.enrolled,
+  c.first_payout,
+  coalesce(l.listens, 0) AS listens,
+  coalesce(l.pre_listens, 0) AS pre_listens,
+  coalesce(r.revenue, 0) AS revenue,
+  coalesce(r.pre_revenue, 0) AS pre_revenue,
+  coalesce(e.episodes, 0) AS episodes,
+  coalesce(e.pre_episodes, 0) AS pre_episodes
+FROM raw_creators c
+LEFT JOIN l USING(creator_id)
+LEFT JOIN r USING(creator_id)
+LEFT JOIN e USING(creator_id)
+"""
+
+def stats_sql(experiments: dict[str, str], metrics: dict[str, dict], start_date: str | None = None) -> str:
+    """One aggregation over all experiments x variants x segment grouping sets, emitting per-metric sums."""
+    assignments = " UNION ALL ".join(
+        f"SELECT '{name}' AS experiment, creator_id, variant FROM ({sql})" for name, sql in experiments.items()
+    )
+    aggs = []
+    for m, spec in metrics.items():
+        f = f" FILTER (WHERE {spec['filter']})" if "filter" in spec else ""
+        y = f"CAST({spec['y']} AS DOUBLE)"
+        aggs += [f"count(*){f} AS {m}__n", f"sum({y}){f} AS {m}__sy", f"sum({y}*{y}){f} AS {m}__syy"]
+        if "d" in spec:
+            d = f"CAST({spec['d']} AS DOUBLE)"
+            aggs += [f"sum({d}){f} AS {m}__sd", f"sum({d}*{d}){f} AS {m}__sdd", f"sum({y}*{d}){f} AS {m}__syd"]
+        if "x" in spec:
+            x = f"CAST({spec['x']} AS DOUBLE)"
+            aggs += [f"sum({x}){f} AS {m}__sx", f"sum({x}*{x}){f} AS {m}__sxx", f"sum({x}*{y}){f} AS {m}__sxy"]
+    sets = ", ".join(["(experiment, variant)"] + [f"(experiment, variant, {s})" for s in SEGMENTS])
+    start = f"DATE '{start_date}'" if start_date else "NULL"
+    seg_cols = ", ".join(f"u.{s}" for s in SEGMENTS)
+    agg_cols = ",\n      ".join(aggs)
+    return f"""
+    WITH units AS ({UNITS_SQL.format(start_date=start)}),
+    assigned AS ({assignments})
+    SELECT
+      a.experiment,
+      a.variant,
+      {seg_cols},
+      {agg_cols}
+    FROM assigned a
+    JOIN units u USING(creator_id)
+    GROUP BY GROUPING SETS ({sets})
+    """
+
+def segment_label(row) -> str:
+    for s in SEGMENTS:
+        if pd.notna(row[s]):
+            return f"{s}={row[s]}"
+    return "overall"
+
+def metric_estimate(spec: dict, m: str, c, t, theta: float | None, mu_x: float | None) -> dict:
+    """Control vs treatment estimate for one metric from two rows of sums."""
+    def arm(r):
+        n = r[f"{m}__n"]
+        if "d" in spec:
+            est, var_est = ratio_from_sums(n, r[f"{m}__sy"], r[f"{m}__syy"], r[f"{m}__sd"], r[f"{m}__sdd"], r[f"{m}__syd"])
+            return n, est, var_est, None
+        mean, var = mean_var_from_sums(n, r[f"{m}__sy"], r[f"{m}__syy"])
+        adj = None
+        if theta is not None:
+            mean_x, var_x = mean_var_from_sums(n, r[f"{m}__sx"], r[f"{m}__sxx"])
+            cov = cov_from_sums(n, r[f"{m}__sx"], r[f"{m}__sy"], r[f"{m}__sxy"])
+            adj = (mean - theta*(mean_x - mu_x), (var - 2*theta*cov + theta*theta*var_x) / n)
+        return n, mean, var / n, adj
+
+    n1, m1, v1, adj1 = arm(c)
+    n2, m2, v2, adj2 = arm(t)
+    diff, se, (lo, hi), p = diff_test(m1, v1, m2, v2)
+    out = {
+        "n_control": int(n1), "n_treatment": int(n2),
+        "control_mean": m1, "treatment_mean": m2,
+        "diff": diff, "rel_lift": diff / m1 if m1 else float("nan"),
+        "se": se, "ci95_low": lo, "ci95_high": hi, "p_value": p,
+    }
+    if adj1 is not None:
+        cdiff, cse, (clo, chi), cp = diff_test(adj1[0], adj1[1], adj2[0], adj2[1])
+        out.update({
+            "cuped_diff": cdiff, "cuped_se": cse, "cuped_ci95_low": clo, "cuped_ci95_high": chi,
+            "cuped_p_value": cp, "variance_reduction": 1 - (cse*cse) / (se*se) if se > 0 else float("nan"),
+        })
+    return out
+
+def analyze(stats: pd.DataFrame, metrics: dict[str, dict]) -> pd.DataFrame:
+    stats = stats.copy()
+    stats["segment"] = stats.apply(segment_label, axis=1)
+    rows = []
+    for (exp, seg), g in stats.groupby(["experiment", "segment"], sort=True):
+        ctrl = g[g["variant"] == CONTROL]
+        if ctrl.empty:
+            continue
+        c = ctrl.iloc[0]
+        for _, t in g[g["variant"] != CONTROL].iterrows():
+            for m, spec in metrics.items():
+                if min(c[f"{m}__n"], t[f"{m}__n"]) < 2:
+                    continue
+                if "d" in spec and not min(c[f"{m}__sd"], t[f"{m}__sd"]):
+                    # a ratio over an arm with no denominator (e.g. no listens in a small segment) is undefined
+                    continue
+                theta = mu_x = None
+                if "x" in spec and "d" not in spec:
+                    # CUPED slope and covariate mean pooled over both arms
+                    pooled = {k: c[f"{m}__{k}"] + t[f"{m}__{k}"] for k in ("n", "sx", "sxx", "sy", "sxy")}
+                    theta = cuped_theta(pooled["n"], pooled["sx"], pooled["sxx"], pooled["sy"], pooled["sxy"])
+                    mu_x = pooled["sx"] / pooled["n"]
+                rows.append({
+                    "experiment": exp, "segment": seg, "variant": t["variant"], "metric": m,
+                    **metric_estimate(spec, m, c, t, theta, mu_x),
+                })
+    return pd.DataFrame(rows)
+
+@traced("experiments.run")
+def run(db_path: str, out_dir: Path, con=None, start_date: str | None = None):
+    with maybe_connect(db_path, con) as con:
+        stats = read_df(con, stats_sql(EXPERIMENTS, METRICS, start_date), name="experiment_stats")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with span("experiments.analyze"):
+        results = analyze(stats, METRICS)
+    results.to_csv(out_dir / "experiment_results.csv", index=False)
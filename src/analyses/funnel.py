@@ -1,59 +1,252 @@
 from __future__ import annotations
+import hashlib
 from pathlib import Path
 import pandas as pd
-from src.utils.db import connect, read_df
+from src.utils import sampling
+from src.utils.db import exec_sql, maybe_connect, read_df, record_build, sql_filters, stale_days, table_exists
+from src.utils.trace import traced
 
-FUNNEL_SQL = r"""
-WITH stages AS (
+STAGES = ["signup", "eligible", "enroll", "first_payout"]
+
+# One row per creator: first timestamp per stage, a stage bitmask (bit i = STAGES[i] reached) and the
+# segment attributes, so every funnel cut is a GROUP BY over this table instead of the event log.
+# category = category of the creator's first podcast; signup_cohort = signup month.
+STAGES_SQL = r"""
+WITH firsts AS (
   SELECT
     creator_id,
-    max(CASE WHEN event_name='signup' THEN 1 ELSE 0 END) AS did_signup,
-    max(CASE WHEN event_name='eligible' THEN 1 ELSE 0 END) AS did_eligible,
-    max(CASE WHEN event_name='enroll' THEN 1 ELSE 0 END) AS did_enroll,
-    max(CASE WHEN event_name='first_payout' THEN 1 ELSE 0 END) AS did_first_payout
+    min(CASE WHEN event_name='signup' THEN event_ts END) AS signup_ts,
+    min(CASE WHEN event_name='eligible' THEN event_ts END) AS eligible_ts,
+    min(CASE WHEN event_name='enroll' THEN event_ts END) AS enroll_ts,
+    min(CASE WHEN event_name='first_payout' THEN event_ts END) AS first_payout_ts
   FROM raw_creator_events
   GROUP BY 1
+),
+first_podcast AS (
+  SELECT creator_id, arg_min(category, podcast_id) AS category
+  FROM raw_podcasts
+  GROUP BY 1
 )
 SELECT
-  sum(did_signup) AS signup,
-  sum(did_eligible) AS eligible,
-  sum(did_enroll) AS enroll,
-  sum(did_first_payout) AS first_payout
-FROM stages;
+  f.creator_id,
+  c.tier,
+  c.country,
+  c.experiment_group,
+  p.category,
+  date_trunc('month', coalesce(f.signup_ts, c.created_at))::DATE AS signup_cohort,
+  (CASE WHEN f.signup_ts IS NOT NULL THEN 1 ELSE 0 END)
+    | (CASE WHEN f.eligible_ts IS NOT NULL THEN 2 ELSE 0 END)
+    | (CASE WHEN f.enroll_ts IS NOT NULL THEN 4 ELSE 0 END)
+    | (CASE WHEN f.first_payout_ts IS NOT NULL THEN 8 ELSE 0 END) AS stage_mask,
+  f.signup_ts,
+  f.eligible_ts,
+  f.enroll_ts,
+  f.first_payout_ts
+FROM firsts f
+JOIN raw_creators c USING(creator_id)
+LEFT JOIN first_podcast p USING(creator_id)
 """
 
-def run(db_path: str, out_dir: Path):
-    con = connect(db_path)
-    df = read_df(con, FUNNEL_SQL)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_dir / "funnel_summary.csv", index=False)
+STAGE_TABLE = "creator_stages"
+STAGE_SOURCES = ["raw_creator_events", "raw_creators", "raw_podcasts"]
 
-    # segment funnel by tier and experiment group (more interview-relevant)
-    seg_sql = r"""
-    WITH stages AS (
-      SELECT
-        e.creator_id,
-        max(CASE WHEN e.event_name='signup' THEN 1 ELSE 0 END) AS did_signup,
-        max(CASE WHEN e.event_name='eligible' THEN 1 ELSE 0 END) AS did_eligible,
-        max(CASE WHEN e.event_name='enroll' THEN 1 ELSE 0 END) AS did_enroll,
-        max(CASE WHEN e.event_name='first_payout' THEN 1 ELSE 0 END) AS did_first_payout
-      FROM raw_creator_events e
-      GROUP BY 1
-    )
+SEGMENT_COLUMNS = ["tier", "country", "experiment_group", "category", "signup_cohort"]
+
+# grouping sets written to funnel_segments.csv; () is the overall funnel
+DEFAULT_SEGMENTS = [
+    (),
+    ("tier", "experiment_group"),
+    ("tier",),
+    ("country",),
+    ("experiment_group",),
+    ("category",),
+    ("signup_cohort",),
+]
+
+def materialize_stages(con, temp: bool = False) -> str:
+    """(Re)build the per-creator stage table; the only scan of raw_creator_events the funnel needs."""
+    kind = "TEMP TABLE" if temp else "TABLE"
+    exec_sql(con, f"CREATE OR REPLACE {kind} {STAGE_TABLE} AS {STAGES_SQL};", name="materialize_stages")
+    return STAGE_TABLE
+
+def refresh_stages(con) -> str:
+    """Rebuild the stage table after a load, unless none of its sources was (re)loaded since the last build.
+
+    Stages are per creator and any reloaded event can move a creator's first timestamps, so a
+    stale table is rebuilt in full.
+    """
+    sig = hashlib.md5(STAGES_SQL.encode(), usedforsecurity=False).hexdigest()
+    if stale_days(con, STAGE_TABLE, STAGE_SOURCES, sig) == []:
+        return f"{STAGE_TABLE}: none (up to date)"
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        materialize_stages(con)
+        record_build(con, STAGE_TABLE, sig)
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    return STAGE_TABLE
+
+def ensure_stages(con) -> str:
+    """Use the warehouse's stage table (refreshed by the loader) or build a connection-local one."""
+    return STAGE_TABLE if table_exists(con, STAGE_TABLE) else materialize_stages(con, temp=True)
+
+def stage_flags_sql() -> str:
+    return ",\n  ".join(f"sum((stage_mask >> {i}) & 1) AS {s}" for i, s in enumerate(STAGES))
+
+def funnel_cube(con, segments: list[tuple[str, ...]] | None = None, filters: dict[str, str] | None = None) -> pd.DataFrame:
+    """Stage counts for every requested segment combination in one GROUPING SETS pass.
+
+    Columns not part of a row's grouping set are NULL; `grouping_set` names the set ('overall' for ()).
+    `filters` restricts the creators counted to the given segment values.
+    """
+    segments = DEFAULT_SEGMENTS if segments is None else segments
+    for seg in [*segments, tuple(filters or {})]:
+        bad = set(seg) - set(SEGMENT_COLUMNS)
+        if bad:
+            raise ValueError(f"Unknown segment column(s) {sorted(bad)}; choose from {SEGMENT_COLUMNS}")
+    table = ensure_stages(con)
+    cols = [c for c in SEGMENT_COLUMNS if any(c in seg for seg in segments)]
+    sets = ", ".join("(" + ", ".join(seg) + ")" for seg in segments)
+    gid = f"grouping({', '.join(cols)})" if cols else "0"
+    sql = f"""
     SELECT
-      c.tier,
-      c.experiment_group,
+      {''.join(f'{c}, ' for c in cols)}{gid} AS _gid,
       count(*) AS creators,
-      sum(did_eligible) AS eligible,
-      sum(did_enroll) AS enroll,
-      sum(did_first_payout) AS first_payout,
-      round(sum(did_enroll)*1.0/nullif(sum(did_eligible),0), 4) AS enroll_rate_given_eligible,
-      round(sum(did_first_payout)*1.0/nullif(sum(did_enroll),0), 4) AS payout_rate_given_enroll
-    FROM stages s
-    JOIN raw_creators c USING(creator_id)
-    GROUP BY 1,2
-    ORDER BY 1,2;
+      {stage_flags_sql()}
+    FROM {table}
+    WHERE {sql_filters(filters)}
+    GROUP BY GROUPING SETS ({sets})
     """
-    seg = read_df(con, seg_sql)
+    df = read_df(con, sql, name="funnel_cube")
+
+    # grouping() sets bit (len(cols)-1-i) when cols[i] is NOT grouped
+    names = {}
+    for seg in segments:
+        bits = sum(1 << (len(cols) - 1 - i) for i, c in enumerate(cols) if c not in seg)
+        names[bits] = "+".join(seg) or "overall"
+    df.insert(0, "grouping_set", df.pop("_gid").map(names))
+    df["enroll_rate_given_eligible"] = (df["enroll"] / df["eligible"].where(df["eligible"] > 0)).round(4)
+    df["payout_rate_given_enroll"] = (df["first_payout"] / df["enroll"].where(df["enroll"] > 0)).round(4)
+    # ENUM segments (tier, country, ...) sort in declaration order; the outputs keep alphabetical order
+    return df.sort_values(["grouping_set", *cols], key=lambda c: c.astype(str)).reset_index(drop=True)
+
+def time_to_convert(con) -> pd.DataFrame:
+    """Days from signup to each later stage, among creators who reached it."""
+    table = ensure_stages(con)
+    parts = [
+        f"""
+        SELECT '{s}' AS stage, date_diff('day', signup_ts, {s}_ts) AS days
+        FROM {table}
+        WHERE {s}_ts IS NOT NULL AND signup_ts IS NOT NULL
+        """
+        for s in STAGES[1:]
+    ]
+    sql = f"""
+    SELECT
+      stage,
+      count(*) AS creators,
+      round(avg(days), 2) AS mean_days,
+      quantile_cont(days, 0.25) AS p25_days,
+      quantile_cont(days, 0.50) AS p50_days,
+      quantile_cont(days, 0.75) AS p75_days,
+      quantile_cont(days, 0.90) AS p90_days
+    FROM ({' UNION ALL '.join(parts)})
+    GROUP BY 1
+    """
+    df = read_df(con, sql, name="funnel_time_to_convert")
+    return df.set_index("stage").loc[[s for s in STAGES[1:] if s in set(df["stage"])]].reset_index()
+
+def funnel_cube_sampled(con, rate: float, segments: list[tuple[str, ...]] | None = None) -> pd.DataFrame:
+    """funnel_cube() estimated from the stratified sample at `rate`, with 95% CIs for every count and rate."""
+    segments = DEFAULT_SEGMENTS if segments is None else segments
+    schema = sampling.require(con, rate)
+    cols = [c for c in SEGMENT_COLUMNS if any(c in seg for seg in segments)]
+    keys = list(dict.fromkeys([*sampling.STRATA, *cols]))
+    sql = f"""
+    SELECT
+      {''.join(f"{c}{'::VARCHAR' if c != 'signup_cohort' else ''} AS {c}, " for c in keys)}
+      count(*) AS creators,
+      {stage_flags_sql()},
+      sum((stage_mask >> 1) & (stage_mask >> 2) & 1) AS eligible_enroll,
+      sum((stage_mask >> 2) & (stage_mask >> 3) & 1) AS enroll_first_payout
+    FROM {schema}.{STAGE_TABLE}
+    GROUP BY ALL
+    """
+    fine = read_df(con, sql, name="funnel_cube_sampled")
+    strata = sampling.strata(con, schema)
+
+    totals = {m: (m, None) for m in ["creators", *STAGES]}
+    ratios = {
+        "enroll_rate_given_eligible": ("enroll", "eligible", None, None, "eligible_enroll"),
+        "payout_rate_given_enroll": ("first_payout", "enroll", None, None, "enroll_first_payout"),
+    }
+    digits = {**{m: 0 for m in totals}, **{r: 4 for r in ratios}}
+    parts = []
+    for seg in segments:
+        out = sampling.estimate(fine, strata, list(seg), totals, ratios, digits=digits)
+        out.insert(0, "grouping_set", "+".join(seg) or "overall")
+        parts.append(out)
+    df = pd.concat(parts, ignore_index=True)
+    df = df[["grouping_set", *cols, *[c for c in df.columns if c not in cols and c != "grouping_set"]]]
+    return df.sort_values(["grouping_set", *cols]).reset_index(drop=True)
+
+def time_to_convert_sampled(con, rate: float) -> pd.DataFrame:
+    """time_to_convert() from the sample: creators scaled up, weighted mean and quantiles (no CIs)."""
+    schema = sampling.require(con, rate)
+    parts = [
+        f"""
+        SELECT '{s}' AS stage, date_diff('day', signup_ts, {s}_ts) AS days, {', '.join(sampling.STRATA)}
+        FROM {schema}.{STAGE_TABLE}
+        WHERE {s}_ts IS NOT NULL AND signup_ts IS NOT NULL
+        """
+        for s in STAGES[1:]
+    ]
+    sql = f"""
+    SELECT t.stage, t.days, w.weight
+    FROM ({' UNION ALL '.join(parts)}) t
+    JOIN {schema}.{sampling.STRATA_TABLE} w USING({', '.join(sampling.STRATA)})
+    """
+    df = read_df(con, sql, name="funnel_time_to_convert_sampled")
+    rows = []
+    for s in STAGES[1:]:
+        d = df[df["stage"] == s]
+        if d.empty:
+            continue
+        q = [round(v, 2) for v in sampling.weighted_quantiles(d["days"].to_numpy(), d["weight"].to_numpy(), [0.25, 0.5, 0.75, 0.9])]
+        rows.append({"stage": s, "creators": int(round(d["weight"].sum())),
+                     "mean_days": round(float((d["days"] * d["weight"]).sum() / d["weight"].sum()), 2),
+                     "p25_days": q[0], "p50_days": q[1], "p75_days": q[2], "p90_days": q[3]})
+    return pd.DataFrame(rows)
+
+@traced("funnel.run")
+def run(db_path: str, out_dir: Path, con=None, segments: list[tuple[str, ...]] | None = None,
+        sample: float | None = None):
+    """Funnel outputs; with `sample` (e.g. 0.01) estimated from the persisted stratified sample, with CIs."""
+    segments = DEFAULT_SEGMENTS if segments is None else segments
+    # the two legacy outputs are always part of the cube
+    segments = list(dict.fromkeys([(), ("tier", "experiment_group"), *segments]))
+    with maybe_connect(db_path, con) as con:
+        if sample:
+            cube = funnel_cube_sampled(con, sample, segments)
+            ttc = time_to_convert_sampled(con, sample)
+        else:
+            cube = funnel_cube(con, segments)
+            ttc = time_to_convert(con)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    def with_cis(cols: list[str]) -> list[str]:
+        return [c for m in cols for c in (m, f"{m}_ci95_low", f"{m}_ci95_high") if c in cube.columns]
+
+    overall = cube[cube["grouping_set"] == "overall"]
+    overall[with_cis(STAGES)].to_csv(out_dir / "funnel_summary.csv", index=False)
+
+    # segment funnel by tier and experiment group (more interview-relevant)
+    seg = cube[cube["grouping_set"] == "tier+experiment_group"]
+    seg = seg[["tier", "experiment_group", *with_cis(["creators", "eligible", "enroll", "first_payout",
+               "enroll_rate_given_eligible", "payout_rate_given_enroll"])]]
     seg.to_csv(out_dir / "funnel_by_tier_experiment.csv", index=False)
-    con.close()
+
+    cube.to_csv(out_dir / "funnel_segments.csv", index=False)
+    ttc.to_csv(out_dir / "funnel_time_to_convert.csv", index=False)
@@ -1,18 +1,19 @@
 from __future__ import annotations
 from pathlib import Path
-import pandas as pd
-from src.utils.db import connect, read_df
+from src.analyses import cube
+from src.utils import sampling
+from src.utils.db import export, maybe_connect, read_df
+from src.utils.trace import traced
 
+# answered from the smallest KPI cube aggregate ({table}) instead of joining the raw event tables
 MONITOR_SQL = r"""
 WITH daily AS (
   SELECT
-    event_date::DATE AS ds,
-    count(DISTINCT creator_id) AS active_creators,
+    ds,
+    sum(active_creators) AS active_creators,
     sum(listens) AS listens,
-    sum(r.revenue_usd) AS revenue_usd
-  FROM raw_listening_events l
-  LEFT JOIN raw_revenue_events r
-    ON r.episode_id = l.episode_id
+    sum(revenue_usd) AS revenue_usd
+  FROM {table}
   GROUP BY 1
 )
 SELECT
@@ -25,9 +26,57 @@ FROM daily
 ORDER BY ds;
 """
 
-def run(db_path: str, out_dir: Path):
-    con = connect(db_path)
-    df = read_df(con, MONITOR_SQL)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_dir / "daily_monitoring.csv", index=False)
-    con.close()
+# per (day, stratum) sums over a sample schema's creators, with the squares/products the variance needs
+MONITOR_SAMPLED_SQL = r"""
+WITH contributions AS (
+  SELECT event_date::DATE AS ds, creator_id, listens, 0.0 AS revenue_usd, true AS listened
+  FROM {schema}.raw_listening_events
+  UNION ALL
+  SELECT event_date::DATE, creator_id, 0, revenue_usd, false
+  FROM {schema}.raw_revenue_events
+),
+daily AS (
+  SELECT ds, creator_id, sum(listens)::DOUBLE AS listens, sum(revenue_usd) AS revenue_usd,
+    bool_or(listened)::INTEGER AS active
+  FROM contributions
+  GROUP BY ALL
+)
+SELECT
+  d.ds,
+  c.tier::VARCHAR AS tier,
+  c.country::VARCHAR AS country,
+  c.experiment_group::VARCHAR AS experiment_group,
+  sum(d.active) AS active_creators,
+  sum(d.listens) AS listens,
+  sum(d.listens * d.listens) AS listens_sq,
+  sum(d.revenue_usd) AS revenue_usd,
+  sum(d.revenue_usd * d.revenue_usd) AS revenue_usd_sq,
+  sum(d.active * d.revenue_usd) AS revenue_usd_active
+FROM daily d
+JOIN {schema}.raw_creators c USING(creator_id)
+GROUP BY ALL
+"""
+
+def run_sampled(con, out_dir: Path, rate: float):
+    """Daily KPIs scaled up from the stratified sample, with 95% CIs."""
+    schema = sampling.require(con, rate)
+    fine = read_df(con, MONITOR_SAMPLED_SQL.format(schema=schema), name="monitoring_sampled")
+    strata = sampling.strata(con, schema)
+    by = ["ds"]
+    out = sampling.estimate(
+        fine, strata, by,
+        totals={"active_creators": ("active_creators", None), "listens": ("listens", "listens_sq"),
+                "revenue_usd": ("revenue_usd", "revenue_usd_sq")},
+        ratios={"rev_per_active_creator": ("revenue_usd", "active_creators", "revenue_usd_sq", None, "revenue_usd_active")},
+        digits={"active_creators": 0, "listens": 0, "revenue_usd": 2, "rev_per_active_creator": 2},
+    )
+    out.sort_values("ds").to_csv(out_dir / "daily_monitoring.csv", index=False)
+
+@traced("monitoring.run")
+def run(db_path: str, out_dir: Path, con=None, sample: float | None = None):
+    # written by DuckDB straight from the query; no DataFrame in between
+    with maybe_connect(db_path, con) as con:
+        if sample:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            return run_sampled(con, out_dir, sample)
+        export(con, MONITOR_SQL.format(table=cube.best_table(con, ())), out_dir / "daily_monitoring.csv", name="monitoring")
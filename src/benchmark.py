@@ -0,0 +1,200 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import duckdb
+from src.analyses import funnel, ab_test, monitoring, experiments, cube
+from src.load_duckdb import TABLES
+from src.modeling.feature_store import CREATOR_FEATURES_SQL
+from src.utils.db import connect, read_arrow
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# n_creators x days
+DEFAULT_SCALES = ["10000x90", "75000x180", "500000x180"]
+
+ANALYSIS_TASKS = ["funnel", "ab_test", "monitoring", "experiments", "active_creators", "cube"]
+TRAIN_TASKS = ["propensity", "churn"]
+
+# the heavy warehouse queries behind each analysis, timed in isolation
+QUERIES = {
+    "funnel_stages": funnel.STAGES_SQL,
+    "ab_test": ab_test.AB_SQL,
+    "monitoring": monitoring.MONITOR_SQL.format(table=cube.rollup_table(())),
+    "experiment_stats": experiments.stats_sql(experiments.EXPERIMENTS, experiments.METRICS),
+    "creator_features": CREATOR_FEATURES_SQL,
+}
+
+# a metric only counts as regressed if it also moved by more than this much in absolute terms
+MIN_DELTA = {"seconds": 0.05, "peak_rss_mb": 16.0}
+
+def parse_scale(s: str) -> tuple[int, int]:
+    n, _, d = s.lower().partition("x")
+    return int(n), int(d or 180)
+
+def run_stage(name: str, cmd: list[str], log_dir: Path) -> dict:
+    """Run one stage in a fresh process; wall seconds and the process's own peak RSS."""
+    log = log_dir / f"{name}.log"
+    t0 = time.perf_counter()
+    with open(log, "w", encoding="utf-8") as fh:
+        proc = subprocess.Popen(cmd, stdout=fh, stderr=subprocess.STDOUT, cwd=ROOT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    secs = time.perf_counter() - t0
+    if proc.returncode != 0:
+        tail = "".join(log.read_text(encoding="utf-8").splitlines(keepends=True)[-20:])
+        raise RuntimeError(f"Stage {name} failed ({proc.returncode}):\n{tail}")
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"seconds": round(secs, 3), "peak_rss_mb": round(rss, 1)}
+
+def warehouse_rows(db_path: Path) -> dict[str, int]:
+    con = connect(db_path, read_only=True)
+    try:
+        return {t: con.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in TABLES}
+    finally:
+        con.close()
+
+def query_times(db_path: Path, repeat: int = 3) -> dict[str, float]:
+    """Median wall seconds per QUERIES entry (results are fully materialized)."""
+    con = connect(db_path, read_only=True)
+    out = {}
+    try:
+        for name, sql in QUERIES.items():
+            runs = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                read_arrow(con, sql, name=name)
+                runs.append(time.perf_counter() - t0)
+            out[name] = round(sorted(runs)[len(runs) // 2], 4)
+    finally:
+        con.close()
+    return out
+
+def bench_scale(n_creators: int, days: int, work_dir: Path, seed: int = 7, stream: bool = False, repeat: int = 3) -> dict:
+    scale_dir = work_dir / f"{n_creators}x{days}"
+    shutil.rmtree(scale_dir, ignore_errors=True)
+    data_dir, out_dir, log_dir = scale_dir / "data", scale_dir / "outputs", scale_dir / "logs"
+    log_dir.mkdir(parents=True)
+    db_path = scale_dir / "warehouse.duckdb"
+    py = sys.executable
+
+    gen = [py, "src/generate_data.py", "--out_dir", str(data_dir), "--n_creators", str(n_creators),
+           "--days", str(days), "--seed", str(seed)]
+    stages = {
+        "generate": run_stage("generate", gen + (["--stream"] if stream else []), log_dir),
+        "load": run_stage("load", [py, "-m", "src.load_duckdb", "--db_path", str(db_path), "--data_dir", str(data_dir)], log_dir),
+    }
+    for task in ANALYSIS_TASKS + TRAIN_TASKS:
+        cmd = [py, "-m", "src.run_analyses", "--db_path", str(db_path), "--out_dir", str(out_dir), "--only", task, "--workers", "1"]
+        stages[task] = run_stage(task, cmd, log_dir)
+
+    rows = warehouse_rows(db_path)
+    total = sum(rows.values())
+    for s in stages.values():
+        s["rows_per_s"] = round(total / s["seconds"]) if s["seconds"] else None
+
+    return {
+        "n_creators": n_creators,
+        "days": days,
+        "rows": rows,
+        "stages": stages,
+        "queries": query_times(db_path, repeat),
+    }
+
+def flatten(results: dict) -> dict[str, float]:
+    """{"<scale>/<stage>/<metric>": value} for comparable metrics."""
+    flat = {}
+    for sc in results["scales"]:
+        key = f"{sc['n_creators']}x{sc['days']}"
+        for stage, m in sc["stages"].items():
+            for metric in MIN_DELTA:
+                flat[f"{key}/{stage}/{metric}"] = m[metric]
+        for q, secs in sc["queries"].items():
+            flat[f"{key}/query:{q}/seconds"] = secs
+    return flat
+
+def compare(results: dict, baseline: dict, time_threshold: float, rss_threshold: float) -> list[str]:
+    """Regressions of `results` against `baseline`; metrics missing from either side are ignored."""
+    cur, base = flatten(results), flatten(baseline)
+    limits = {"seconds": time_threshold, "peak_rss_mb": rss_threshold}
+    regressions = []
+    for k in sorted(cur.keys() & base.keys()):
+        metric = k.rsplit("/", 1)[1]
+        old, new = base[k], cur[k]
+        if new > old * (1 + limits[metric]) and new - old > MIN_DELTA[metric]:
+            regressions.append(f"{k}: {old} -> {new} (+{(new / old - 1) * 100 if old else float('inf'):.0f}%)")
+    return regressions
+
+def print_summary(results: dict) -> None:
+    for sc in results["scales"]:
+        print(f"\n== {sc['n_creators']:,} creators x {sc['days']} days ({sum(sc['rows'].values()):,} rows)")
+        for stage, m in sc["stages"].items():
+            print(f"  {stage:<12} {m['seconds']:>9.2f}s {m['peak_rss_mb']:>9.1f} MB {m['rows_per_s'] or 0:>12,} rows/s")
+        for q, secs in sc["queries"].items():
+            print(f"  query:{q:<20} {secs:>9.3f}s")
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--scales", nargs="+", default=DEFAULT_SCALES, help="n_creators x days, e.g. 75000x180")
+    p.add_argument("--work_dir", type=str, default=None, help="keep generated data/warehouses here (default: temp dir)")
+    p.add_argument("--results", type=str, default="benchmarks/results.json")
+    p.add_argument("--baseline", type=str, default="benchmarks/baseline.json")
+    p.add_argument("--update_baseline", action="store_true", help="store these results as the new baseline")
+    # allowed relative slowdown / memory growth before a metric counts as a regression
+    p.add_argument("--time_threshold", type=float, default=0.25)
+    p.add_argument("--rss_threshold", type=float, default=0.25)
+    p.add_argument("--repeat", type=int, default=3, help="runs per timed query (median is kept)")
+    p.add_argument("--stream", action="store_true", help="benchmark the Parquet (--stream) generator path")
+    p.add_argument("--seed", type=int, default=7)
+    args = p.parse_args()
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="podcast_bench_"))
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(),
+                 "duckdb": duckdb.__version__, "cpus": os.cpu_count()},
+        "scales": [],
+    }
+    try:
+        for s in args.scales:
+            n, d = parse_scale(s)
+            print(f"Benchmarking {n:,} creators x {d} days ...")
+            results["scales"].append(bench_scale(n, d, work_dir, args.seed, args.stream, args.repeat))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_summary(results)
+    out = Path(args.results)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\nWrote: {out}")
+
+    baseline = Path(args.baseline)
+    if args.update_baseline:
+        baseline.parent.mkdir(parents=True, exist_ok=True)
+        baseline.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Baseline updated: {baseline}")
+        return
+    if not baseline.exists():
+        print(f"No baseline at {baseline}; rerun with --update_baseline to store one")
+        return
+    regressions = compare(results, json.loads(baseline.read_text(encoding="utf-8")), args.time_threshold, args.rss_threshold)
+    if regressions:
+        print("\nRegressions vs baseline:")
+        for r in regressions:
+            print(f"  {r}")
+        raise SystemExit(1)
+    print("\nNo regressions vs baseline")
+
+if __name__ == "__main__":
+    main()
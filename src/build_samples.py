@@ -0,0 +1,97 @@
+from __future__ import annotations
+import argparse
+import time
+from src.analyses import funnel
+from src.utils.db import connect, exec_sql, record_build, stale_days, table_exists
+from src.utils.sampling import MEMBERS_TABLE, RATES, STRATA, STRATA_TABLE, schema_name
+
+# tables copied into each sample schema, restricted to the sampled creators
+SAMPLED_TABLES = [
+    "raw_creators",
+    "raw_podcasts",
+    "raw_episodes",
+    "raw_creator_events",
+    "raw_listening_events",
+    "raw_revenue_events",
+    funnel.STAGE_TABLE,
+]
+SOURCE_TABLES = SAMPLED_TABLES[:-1]
+
+# every stratum keeps at least this many creators, so each has a variance estimate
+MIN_PER_STRATUM = 2
+
+# Within each stratum creators are ranked by a hash of creator_id and the first ceil(N * rate) are
+# kept: exact per-stratum rates, nested samples (1% is a subset of 10%) and the same creators from
+# load to load.
+MEMBERS_SQL = r"""
+WITH ranked AS (
+  SELECT
+    creator_id,
+    {strata},
+    row_number() OVER (PARTITION BY {strata} ORDER BY hash(creator_id), creator_id) AS rk,
+    count(*) OVER (PARTITION BY {strata}) AS n_pop
+  FROM raw_creators
+)
+SELECT creator_id, {strata}
+FROM ranked
+WHERE rk <= greatest(ceil(n_pop * {rate}), {min_n})
+"""
+
+STRATA_SQL = r"""
+SELECT {strata}, p.n_pop, s.n_sample, p.n_pop / s.n_sample AS weight
+FROM (SELECT {strata}, count(*) AS n_pop FROM raw_creators GROUP BY ALL) p
+JOIN (SELECT {strata}, count(*) AS n_sample FROM {schema}.{members} GROUP BY ALL) s USING({strata})
+"""
+
+def build_sample(con, rate: float) -> str:
+    schema = schema_name(rate)
+    strata = ", ".join(STRATA)
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+    exec_sql(con, f"CREATE OR REPLACE TABLE {schema}.{MEMBERS_TABLE} AS "
+                  f"{MEMBERS_SQL.format(strata=strata, rate=rate, min_n=MIN_PER_STRATUM)}", name=f"{schema} members")
+    exec_sql(con, f"CREATE OR REPLACE TABLE {schema}.{STRATA_TABLE} AS "
+                  f"{STRATA_SQL.format(strata=strata, schema=schema, members=MEMBERS_TABLE)}", name=f"{schema} strata")
+    for t in SAMPLED_TABLES:
+        exec_sql(con, f"CREATE OR REPLACE TABLE {schema}.{t} AS SELECT * FROM {t} "
+                      f"WHERE creator_id IN (SELECT creator_id FROM {schema}.{MEMBERS_TABLE})", name=f"{schema}.{t}")
+    return schema
+
+def build_samples(con, rates: list[float] | None = None) -> str:
+    """Refresh the stratified samples after a load; skipped when no source table changed since the last build."""
+    rates = RATES if rates is None else rates
+    funnel.ensure_stages(con)
+    built = []
+    for rate in rates:
+        schema = schema_name(rate)
+        sig = f"rate={rate},min={MIN_PER_STRATUM},strata={'+'.join(STRATA)}"
+        # any reloaded partition can move creators' rows, so a stale sample is rebuilt in full
+        if stale_days(con, f"{schema}.{STRATA_TABLE}", SOURCE_TABLES, sig) == [] and table_exists(con, f"{schema}.{funnel.STAGE_TABLE}"):
+            continue
+        con.execute("BEGIN TRANSACTION;")
+        try:
+            build_sample(con, rate)
+            # every sample table is recorded so cached queries over any of them see the rebuild
+            for t in (STRATA_TABLE, MEMBERS_TABLE, *SAMPLED_TABLES):
+                record_build(con, f"{schema}.{t}", sig)
+            con.execute("COMMIT;")
+        except Exception:
+            con.execute("ROLLBACK;")
+            raise
+        built.append(schema)
+    return ", ".join(built) or "samples: none (up to date)"
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--db_path", type=str, default="warehouse.duckdb")
+    p.add_argument("--rates", type=float, nargs="+", default=RATES, help="sampling rates, e.g. 0.01 0.1")
+    args = p.parse_args()
+    t0 = time.perf_counter()
+    con = connect(args.db_path)
+    try:
+        name = build_samples(con, args.rates)
+    finally:
+        con.close()
+    print(f"Built {name} in {time.perf_counter() - t0:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,240 @@
 from __future__ import annotations
 import argparse
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import numpy as np
 import pandas as pd
 from faker import Faker
 
+CATEGORIES = np.array(["News", "Education", "Comedy", "Sports", "True Crime", "Business", "Health", "Technology"], dtype=object)
+CREATOR_TIERS = np.array(["Small", "Mid", "Large"], dtype=object)
+COUNTRIES = np.array(["US", "CA", "GB", "AU", "DE"], dtype=object)
+EXPERIMENT_GROUPS = np.array(["control", "treatment"], dtype=object)
+
+# per-tier lookups, indexed by tier code (position in CREATOR_TIERS)
+TIER_P = np.array([0.65, 0.28, 0.07])
+TIER_PUBLISH_RATE = np.array([0.03, 0.06, 0.10])  # expected episodes/day
+TIER_BASE_LISTENS = np.array([250.0, 800.0, 3000.0])
+
+# per-category listen boost, indexed by category code (position in CATEGORIES)
+CATEGORY_BOOST = 1.0 + 0.08*np.isin(CATEGORIES, ["True Crime", "Comedy"]) + 0.05*np.isin(CATEGORIES, ["News", "Business"])
+
+# podcasts sampled as "active" per day
+DAILY_SAMPLE = 6000
+
+# day-partitioned tables written by --stream
+FACT_TABLES = ["episodes", "listening_events", "revenue_events"]
+
+# (event_name, creator flag column, min_offset_days, max_offset_days) after created_at
+LIFECYCLE_STAGES = [
+    ("eligible", "eligible", 5, 60),
+    ("enroll", "enrolled", 10, 90),
+    ("first_payout", "first_payout", 20, 120),
+]
+
+def build_creators(rng: np.random.Generator, n_creators: int, today: pd.Timestamp) -> pd.DataFrame:
+    age = rng.integers(30, 720, size=n_creators)
+    tier_code = rng.choice(len(CREATOR_TIERS), size=n_creators, p=TIER_P)
+    country_code = rng.choice(len(COUNTRIES), size=n_creators, p=[0.62, 0.10, 0.12, 0.08, 0.08])
+    return pd.DataFrame({
+        "creator_id": np.arange(1, n_creators + 1, dtype=np.int64),
+        "created_at": today - pd.to_timedelta(age, unit="D"),
+        "tier": CREATOR_TIERS[tier_code],
+        "country": COUNTRIES[country_code],
+    })
+
+def build_podcasts(rng: np.random.Generator, creators_df: pd.DataFrame) -> pd.DataFrame:
+    n_creators = len(creators_df)
+    n_podcasts = int(n_creators * 1.15)
+    creator_id = rng.integers(1, n_creators + 1, size=n_podcasts)
+    category_code = rng.integers(0, len(CATEGORIES), size=n_podcasts)
+    # creator_id is dense 1..n, so position creator_id-1 is the creator's row
+    created_at = creators_df["created_at"].to_numpy()[creator_id - 1] + pd.to_timedelta(rng.integers(0, 30, size=n_podcasts), unit="D").to_numpy()
+    return pd.DataFrame({
+        "podcast_id": np.arange(1, n_podcasts + 1, dtype=np.int64),
+        "creator_id": creator_id.astype(np.int64),
+        "category": CATEGORIES[category_code],
+        "created_at": created_at,
+    })
+
+def assign_lifecycle(rng: np.random.Generator, creators_df: pd.DataFrame, today: pd.Timestamp) -> None:
+    # stages: signup -> eligible -> enroll -> first_payout
+    # Experiment flag: "new_enrollment_banner" (A/B)
+    creators_df["experiment_group"] = rng.choice(EXPERIMENT_GROUPS, size=len(creators_df), p=[0.5, 0.5])
+
+    # eligibility depends on tier + age
+    age_days = (today - creators_df["created_at"]).dt.days
+    tier_factor = creators_df["tier"].map({"Small": 0.20, "Mid": 0.35, "Large": 0.55}).values
+    eligible_prob = np.clip(0.15 + tier_factor + (age_days.values / 2000), 0, 0.95)
+    creators_df["eligible"] = rng.binomial(1, eligible_prob)
+
+    # enrollment probability: eligible + experiment treatment uplift
+    uplift = np.where(creators_df["experiment_group"].values == "treatment", 0.06, 0.0)
+    enroll_prob = np.clip(0.08 + 0.35*creators_df["eligible"].values + uplift + 0.08*(creators_df["tier"].values=="Large"), 0, 0.92)
+    creators_df["enrolled"] = rng.binomial(1, enroll_prob)
+
+    # payouts probability: enrolled + tier + category mix (proxy)
+    payout_prob = np.clip(0.05 + 0.55*creators_df["enrolled"].values + 0.10*(creators_df["tier"].values=="Large"), 0, 0.90)
+    creators_df["first_payout"] = rng.binomial(1, payout_prob)
+
+def build_creator_events(rng: np.random.Generator, creators_df: pd.DataFrame) -> pd.DataFrame:
+    creator_id = creators_df["creator_id"].to_numpy()
+    created_at = creators_df["created_at"].to_numpy()
+
+    # signup event at created_at, later stages at a random offset when reached
+    ts = [created_at]
+    ids = [creator_id]
+    names = [np.full(len(creator_id), "signup", dtype=object)]
+    order = [np.zeros(len(creator_id), dtype=np.int8)]
+    for i, (stage, flag, lo, hi) in enumerate(LIFECYCLE_STAGES, start=1):
+        mask = creators_df[flag].to_numpy() == 1
+        offsets = pd.to_timedelta(rng.integers(lo, hi, size=int(mask.sum())), unit="D").to_numpy()
+        ts.append(created_at[mask] + offsets)
+        ids.append(creator_id[mask])
+        names.append(np.full(int(mask.sum()), stage, dtype=object))
+        order.append(np.full(int(mask.sum()), i, dtype=np.int8))
+
+    ids = np.concatenate(ids)
+    order = np.concatenate(order)
+    # keep the log grouped per creator in stage order
+    sort = np.lexsort((order, ids))
+    return pd.DataFrame({
+        "event_ts": np.concatenate(ts)[sort],
+        "creator_id": ids[sort],
+        "event_name": np.concatenate(names)[sort],
+    })
+
+def podcast_lookups(creators_df: pd.DataFrame, podcasts_df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """Per-podcast arrays (podcast row -> creator tier/enrolled, category) used by the day loop."""
+    tier_code = pd.Categorical(creators_df["tier"], categories=CREATOR_TIERS).codes
+    category_code = pd.Categorical(podcasts_df["category"], categories=CATEGORIES).codes
+    creator_row = podcasts_df["creator_id"].to_numpy() - 1
+    return {
+        "podcast_id": podcasts_df["podcast_id"].to_numpy(),
+        "creator_id": podcasts_df["creator_id"].to_numpy(),
+        "tier_code": tier_code[creator_row],
+        "category_code": category_code,
+        "enrolled": creators_df["enrolled"].to_numpy()[creator_row],
+    }
+
+def simulate_day(rng: np.random.Generator, d: pd.Timestamp, pods: dict[str, np.ndarray], first_episode_id: int):
+    """Episodes, listens and revenue for one day. Returns three DataFrames."""
+    # sample active podcasts today
+    n_pods = len(pods["podcast_id"])
+    todays = rng.choice(n_pods, size=min(DAILY_SAMPLE, n_pods), replace=False)
+
+    # publish probability by creator tier
+    tier_code = pods["tier_code"][todays]
+    published = todays[rng.random(len(todays)) < TIER_PUBLISH_RATE[tier_code]]
+    n = len(published)
+    tier_code = pods["tier_code"][published]
+
+    episode_id = np.arange(first_episode_id, first_episode_id + n, dtype=np.int64)
+    podcast_id = pods["podcast_id"][published]
+    creator_id = pods["creator_id"][published]
+    ds = np.full(n, d.to_datetime64())
+    duration = np.clip(rng.normal(38, 14, size=n), 8, 140).astype(np.int64)
+
+    # listens proxy: depends on tier + category
+    base = TIER_BASE_LISTENS[tier_code] * CATEGORY_BOOST[pods["category_code"][published]]
+    listens = np.clip(rng.lognormal(mean=np.log(base), sigma=0.45), 20, 250000).astype(np.int64)
+
+    # Revenue depends on listens + enrolled; enrolled creators get higher RPM
+    rpm = np.where(pods["enrolled"][published]==1, rng.normal(18, 3, n), rng.normal(6, 2, n))
+    revenue = np.maximum(0, (listens/1000) * rpm)
+
+    episodes = pd.DataFrame({
+        "episode_id": episode_id,
+        "podcast_id": podcast_id,
+        "creator_id": creator_id,
+        "published_at": ds,
+        "duration_min": duration,
+    })
+    listens_df = pd.DataFrame({
+        "event_date": ds,
+        "episode_id": episode_id,
+        "podcast_id": podcast_id,
+        "creator_id": creator_id,
+        "listens": listens,
+    })
+    rev = pd.DataFrame({
+        "event_date": ds,
+        "creator_id": creator_id,
+        "podcast_id": podcast_id,
+        "episode_id": episode_id,
+        "revenue_usd": np.round(revenue, 2),
+    })
+    return episodes, listens_df, rev
+
+# per-worker podcast lookups, set once by _init_worker so day tasks only ship dates + seeds
+_PODS: dict[str, np.ndarray] | None = None
+
+def _init_worker(pods: dict[str, np.ndarray]) -> None:
+    global _PODS
+    _PODS = pods
+
+def simulate_days(tasks: list[tuple[pd.Timestamp, np.random.SeedSequence]]):
+    """Simulate a chunk of days, each from its own seed stream. Episode ids start at 1 per day."""
+    return [simulate_day(np.random.default_rng(ss), d, _PODS, 1) for d, ss in tasks]
+
+def iter_days(dates: pd.DatetimeIndex, seed: int, pods: dict[str, np.ndarray], workers: int = 1, chunk_days: int = 8):
+    """Yield (day, episodes, listens, revenue) in date order with globally sequential episode ids.
+
+    Day i always draws from SeedSequence(seed).spawn(len(dates))[i], so output is identical for
+    any worker count. At most 2 chunks per worker are in flight, which bounds buffered results.
+    """
+    tasks = list(zip(dates, np.random.SeedSequence(seed).spawn(len(dates))))
+    chunks = [tasks[i:i + chunk_days] for i in range(0, len(tasks), chunk_days)]
+
+    def results():
+        if workers <= 1:
+            _init_worker(pods)
+            for chunk in chunks:
+                yield simulate_days(chunk)
+            return
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pods,)) as ex:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(ex.submit(simulate_days, chunk))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    offset = 0
+    for chunk_tasks, chunk_results in zip(chunks, results()):
+        for (d, _), (ep, li, rv) in zip(chunk_tasks, chunk_results):
+            for df in (ep, li, rv):
+                df["episode_id"] += offset
+            offset += len(ep)
+            yield d, ep, li, rv
+
+def write_partition(df: pd.DataFrame, out_dir: Path, table: str, d: pd.Timestamp) -> None:
+    """Write one day of a fact table to out_dir/<table>/ds=YYYY-MM-DD/part-0.parquet."""
+    part = out_dir / table / f"ds={d:%Y-%m-%d}"
+    part.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(part / "part-0.parquet", index=False)
+
+def write_table(df: pd.DataFrame, out_dir: Path, table: str) -> None:
+    """Write an unpartitioned table to out_dir/<table>/part-0.parquet."""
+    (out_dir / table).mkdir(parents=True, exist_ok=True)
+    df.to_parquet(out_dir / table / "part-0.parquet", index=False)
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--out_dir", type=str, default="data")
     p.add_argument("--n_creators", type=int, default=75000)
     p.add_argument("--days", type=int, default=180)
     p.add_argument("--seed", type=int, default=7)
+    # flush each day to day-partitioned Parquet instead of collecting everything into one CSV per table
+    p.add_argument("--stream", action="store_true")
+    # processes simulating day chunks; output is identical for any value
+    p.add_argument("--workers", type=int, default=1)
     args = p.parse_args()
+    if args.days < 1:
+        p.error("--days must be at least 1")
 
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -19,127 +242,49 @@ def main():
     rng = np.random.default_rng(args.seed)
     fake = Faker()
     Faker.seed(args.seed)
+    today = pd.Timestamp.today().normalize()
 
     # --- dimensions ---
-    categories = ["News", "Education", "Comedy", "Sports", "True Crime", "Business", "Health", "Technology"]
-    creator_tiers = ["Small", "Mid", "Large"]
-
-    creators = []
-    for cid in range(1, args.n_creators + 1):
-        created_at = pd.Timestamp.today().normalize() - pd.Timedelta(days=int(rng.integers(30, 720)))
-        tier = rng.choice(creator_tiers, p=[0.65, 0.28, 0.07])
-        country = rng.choice(["US", "CA", "GB", "AU", "DE"], p=[0.62, 0.10, 0.12, 0.08, 0.08])
-        creators.append({
-            "creator_id": cid,
-            "created_at": created_at,
-            "tier": tier,
-            "country": country,
-        })
-    creators_df = pd.DataFrame(creators)
-
-    podcasts = []
-    n_podcasts = int(args.n_creators * 1.15)
-    for pid in range(1, n_podcasts + 1):
-        creator_id = int(rng.integers(1, args.n_creators + 1))
-        category = rng.choice(categories)
-        podcasts.append({
-            "podcast_id": pid,
-            "creator_id": creator_id,
-            "category": category,
-            "created_at": creators_df.loc[creators_df.creator_id == creator_id, "created_at"].iloc[0] + pd.Timedelta(days=int(rng.integers(0, 30)))
-        })
-    podcasts_df = pd.DataFrame(podcasts)
+    creators_df = build_creators(rng, args.n_creators, today)
+    podcasts_df = build_podcasts(rng, creators_df)
 
     # --- events / lifecycle ---
-    # stages: signup -> eligible -> enroll -> first_payout
-    base_date = pd.Timestamp.today().normalize() - pd.Timedelta(days=args.days)
+    assign_lifecycle(rng, creators_df, today)
+    events_df = build_creator_events(rng, creators_df)
+
+    # --- episodes + listening + revenue (creator daily) ---
+    base_date = today - pd.Timedelta(days=args.days)
     dates = pd.date_range(base_date, periods=args.days, freq="D")
+    pods = podcast_lookups(creators_df, podcasts_df)
 
-    # Experiment flag: "new_enrollment_banner" (A/B)
-    creators_df["experiment_group"] = rng.choice(["control", "treatment"], size=len(creators_df), p=[0.5, 0.5])
+    if args.stream:
+        # peak memory is one day of facts on top of the dimensions, whatever --days is
+        for table in FACT_TABLES:
+            shutil.rmtree(out_dir / table, ignore_errors=True)
+        write_table(creators_df, out_dir, "creators")
+        write_table(podcasts_df, out_dir, "podcasts")
+        write_table(events_df, out_dir, "creator_events")
 
-    # eligibility depends on tier + age
-    age_days = (pd.Timestamp.today().normalize() - creators_df["created_at"]).dt.days
-    tier_factor = creators_df["tier"].map({"Small": 0.20, "Mid": 0.35, "Large": 0.55}).values
-    eligible_prob = np.clip(0.15 + tier_factor + (age_days.values / 2000), 0, 0.95)
-    creators_df["eligible"] = rng.binomial(1, eligible_prob)
+        n_episodes = 0
+        for d, ep, li, rv in iter_days(dates, args.seed, pods, args.workers):
+            n_episodes += len(ep)
+            write_partition(ep, out_dir, "episodes", d)
+            write_partition(li, out_dir, "listening_events", d)
+            write_partition(rv, out_dir, "revenue_events", d)
 
-    # enrollment probability: eligible + experiment treatment uplift
-    uplift = np.where(creators_df["experiment_group"].values == "treatment", 0.06, 0.0)
-    enroll_prob = np.clip(0.08 + 0.35*creators_df["eligible"].values + uplift + 0.08*(creators_df["tier"].values=="Large"), 0, 0.92)
-    creators_df["enrolled"] = rng.binomial(1, enroll_prob)
+        print(f"Wrote day-partitioned Parquet to: {out_dir.resolve()}")
+        print(f"creators: {len(creators_df):,} | podcasts: {len(podcasts_df):,} | episodes: {n_episodes:,} | events: {len(events_df):,} | listens: {n_episodes:,} | revenue rows: {n_episodes:,}")
+        return
 
-    # payouts probability: enrolled + tier + category mix (proxy)
-    payout_prob = np.clip(0.05 + 0.55*creators_df["enrolled"].values + 0.10*(creators_df["tier"].values=="Large"), 0, 0.90)
-    creators_df["first_payout"] = rng.binomial(1, payout_prob)
+    episodes, listens, revenue = [], [], []
+    for d, ep, li, rv in iter_days(dates, args.seed, pods, args.workers):
+        episodes.append(ep)
+        listens.append(li)
+        revenue.append(rv)
 
-    # Create event log
-    events = []
-    for row in creators_df.itertuples(index=False):
-        # signup event at created_at
-        events.append({"event_ts": row.created_at, "creator_id": row.creator_id, "event_name": "signup"})
-        # eligible event sometime later if eligible
-        if row.eligible == 1:
-            events.append({"event_ts": row.created_at + pd.Timedelta(days=int(rng.integers(5, 60))), "creator_id": row.creator_id, "event_name": "eligible"})
-        if row.enrolled == 1:
-            events.append({"event_ts": row.created_at + pd.Timedelta(days=int(rng.integers(10, 90))), "creator_id": row.creator_id, "event_name": "enroll"})
-        if row.first_payout == 1:
-            events.append({"event_ts": row.created_at + pd.Timedelta(days=int(rng.integers(20, 120))), "creator_id": row.creator_id, "event_name": "first_payout"})
-    events_df = pd.DataFrame(events)
-
-    # --- episodes + listening ---
-    # episodes per podcast per day depends on tier
-    tier_rate = {"Small": 0.03, "Mid": 0.06, "Large": 0.10}  # expected episodes/day
-    episodes = []
-    listens = []
-    ep_id = 1
-    for d in dates:
-        # sample active podcasts today
-        # publish probability by creator tier
-        todays = podcasts_df.sample(n=min(6000, len(podcasts_df)), random_state=int(d.strftime("%j")))
-        for r in todays.itertuples(index=False):
-            tier = creators_df.loc[creators_df.creator_id == r.creator_id, "tier"].iloc[0]
-            p_publish = tier_rate[tier]
-            if rng.random() < p_publish:
-                episodes.append({
-                    "episode_id": ep_id,
-                    "podcast_id": r.podcast_id,
-                    "creator_id": r.creator_id,
-                    "published_at": d,
-                    "duration_min": int(np.clip(rng.normal(38, 14), 8, 140))
-                })
-                # listens proxy: depends on tier + category
-                base = {"Small": 250, "Mid": 800, "Large": 3000}[tier]
-                cat_boost = 1.0 + 0.08*(r.category in ["True Crime", "Comedy"]) + 0.05*(r.category in ["News","Business"])
-                l = int(np.clip(rng.lognormal(mean=np.log(base*cat_boost), sigma=0.45), 20, 250000))
-                listens.append({
-                    "event_date": d,
-                    "episode_id": ep_id,
-                    "podcast_id": r.podcast_id,
-                    "creator_id": r.creator_id,
-                    "listens": l
-                })
-                ep_id += 1
-
-    episodes_df = pd.DataFrame(episodes)
-    listens_df = pd.DataFrame(listens)
-
-    # --- revenue (creator daily) ---
-    # Revenue depends on listens + enrolled
-    if not listens_df.empty:
-        rev = listens_df.merge(creators_df[["creator_id","enrolled"]], on="creator_id", how="left")
-        # enrolled creators get higher RPM
-        rpm = np.where(rev["enrolled"].values==1, rng.normal(18, 3, len(rev)), rng.normal(6, 2, len(rev)))
-        revenue = np.maximum(0, (rev["listens"].values/1000) * rpm)
-        rev_df = pd.DataFrame({
-            "event_date": rev["event_date"].values,
-            "creator_id": rev["creator_id"].values,
-            "podcast_id": rev["podcast_id"].values,
-            "episode_id": rev["episode_id"].values,
-            "revenue_usd": np.round(revenue, 2)
-        })
-    else:
-        rev_df = pd.DataFrame(columns=["event_date","creator_id","podcast_id","episode_id","revenue_usd"])
+    episodes_df = pd.concat(episodes, ignore_index=True)
+    listens_df = pd.concat(listens, ignore_index=True)
+    rev_df = pd.concat(revenue, ignore_index=True)
 
     # --- write outputs ---
     creators_df.to_csv(out_dir / "creators.csv", index=False)
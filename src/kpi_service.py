@@ -0,0 +1,447 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+import duckdb
+import numpy as np
+import pandas as pd
+from src.analyses import cube, experiments, funnel
+from src.modeling.scoring import default_score_dir
+from src.utils.db import CursorPool, read_df, sql_filters
+
+# Local HTTP service answering the dashboard's queries live from the warehouse (stdlib asyncio only).
+# Queries run on `workers` threads, each holding one cursor of a read-only CursorPool, so at most
+# `workers` queries hit DuckDB at once however many clients connect. Identical concurrent requests
+# share one query, and responses are cached (LRU, bounded in bytes) under the warehouse version: the
+# stat of the database file, its WAL and the scores partitions. A reload or rescoring changes the
+# version, which reopens the pool and drops the cache. DuckDB lets no process write while another
+# holds the file open, so the pool is released after `release_after` idle seconds to let the loader
+# in; requests during a load get 503 with Retry-After.
+MAX_TOP_K = 10_000
+DEFAULT_PORT = 8765
+KEEPALIVE_SECONDS = 30
+SCORE_FILTERS = ["tier", "country", "experiment_group"]
+# models with score partitions, and the command that writes them
+SCORE_COMMANDS = {
+    "propensity": "src.modeling.train_propensity score",
+    "propensity_sgd": "src.modeling.train_propensity score --out_of_core",
+    "churn": "src.modeling.train_churn score",
+}
+
+def _csv(value: str | None, allowed: list[str], name: str) -> tuple[str, ...]:
+    cols = tuple(v for v in (value or "").split(",") if v)
+    bad = set(cols) - set(allowed)
+    if bad:
+        raise ValueError(f"Unknown {name} value(s) {sorted(bad)}; choose from {allowed}")
+    return cols
+
+def _date(value: str | None, name: str) -> str | None:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be a YYYY-MM-DD date, got {value!r}") from None
+
+def monitoring(con, db_path: str, q: dict[str, str]) -> pd.DataFrame:
+    """Daily monitoring KPIs (daily_monitoring.csv) by optional cube dimensions, filtered and date-bounded."""
+    by = _csv(q.get("by"), cube.DIMENSIONS, "by")
+    filters = {c: q[c] for c in cube.DIMENSIONS if c in q}
+    start, end = _date(q.get("start"), "start"), _date(q.get("end"), "end")
+    where = " AND ".join([*([f"ds >= DATE '{start}'"] if start else []), *([f"ds <= DATE '{end}'"] if end else [])]) or "true"
+    return read_df(con, f"""
+    SELECT ds, {''.join(f'{d}, ' for d in by)}active_creators, listens, revenue_usd,
+      round(revenue_usd/nullif(active_creators,0), 2) AS rev_per_active_creator
+    FROM ({cube.query_sql(con, by, filters)})
+    WHERE {where}
+    ORDER BY ALL
+    """, name="service monitoring")
+
+def funnel_segments(con, db_path: str, q: dict[str, str]) -> pd.DataFrame:
+    """Stage counts and conversion rates by `by` segments (default tier, experiment_group), filtered."""
+    by = _csv(q.get("by", "tier,experiment_group"), funnel.SEGMENT_COLUMNS, "by")
+    filters = {c: q[c] for c in funnel.SEGMENT_COLUMNS if c in q}
+    return funnel.funnel_cube(con, [by], filters).drop(columns="grouping_set")
+
+def experiment_results(con, db_path: str, q: dict[str, str]) -> pd.DataFrame:
+    """Variant vs control estimates (experiment_results.csv), optionally for one experiment/metric/segment."""
+    exps = _csv(q.get("experiment"), list(experiments.EXPERIMENTS), "experiment") or tuple(experiments.EXPERIMENTS)
+    metrics = _csv(q.get("metric"), list(experiments.METRICS), "metric") or tuple(experiments.METRICS)
+    stats = read_df(con, experiments.stats_sql(
+        {e: experiments.EXPERIMENTS[e] for e in exps}, {m: experiments.METRICS[m] for m in metrics},
+        _date(q.get("start_date"), "start_date"),
+    ), name="service experiment_stats")
+    results = experiments.analyze(stats, {m: experiments.METRICS[m] for m in metrics})
+    if "segment" in q and not results.empty:
+        results = results[results["segment"] == q["segment"]]
+    return results.reset_index(drop=True)
+
+def top_creators(con, db_path: str, q: dict[str, str]) -> pd.DataFrame:
+    """Top-k creators by a model's latest scores (the scoring run's Parquet partitions), filtered."""
+    model = q.get("model", "propensity")
+    if model not in SCORE_COMMANDS:
+        raise ValueError(f"model must be one of {', '.join(SCORE_COMMANDS)}, got {model!r}")
+    try:
+        k = int(q.get("k", 100))
+    except ValueError:
+        raise ValueError(f"k must be an integer, got {q['k']!r}") from None
+    if not 1 <= k <= MAX_TOP_K:
+        raise ValueError(f"k must be in [1, {MAX_TOP_K}]")
+    part_dir = default_score_dir(db_path) / f"model={model}"
+    if not any(part_dir.glob("run_date=*/*.parquet")):
+        raise FileNotFoundError(f"No {model} scores under {part_dir}; run python -m {SCORE_COMMANDS[model]}")
+    filters = {f"c.{c}": q[c] for c in SCORE_FILTERS if c in q}
+    return read_df(con, f"""
+    WITH s AS (SELECT * FROM read_parquet('{part_dir}/run_date=*/*.parquet', hive_partitioning = true))
+    SELECT s.creator_id, c.tier, c.country, c.experiment_group, s.score, s.run_date
+    FROM s
+    JOIN raw_creators c USING(creator_id)
+    WHERE s.run_date = (SELECT max(run_date) FROM s) AND {sql_filters(filters)}
+    ORDER BY s.score DESC, s.creator_id
+    LIMIT {k}
+    """, name="service top_creators")
+
+# path -> (fn(cursor, db_path, params) -> DataFrame, accepted query parameters besides `format`)
+ENDPOINTS = {
+    "/monitoring": (monitoring, {"by", "start", "end", *cube.DIMENSIONS}),
+    "/funnel": (funnel_segments, {"by", *funnel.SEGMENT_COLUMNS}),
+    "/experiments": (experiment_results, {"experiment", "metric", "segment", "start_date"}),
+    "/top_creators": (top_creators, {"model", "k", *SCORE_FILTERS}),
+}
+FORMATS = {"json": "application/json", "csv": "text/csv; charset=utf-8"}
+
+def warehouse_version(db_path: str | Path) -> tuple:
+    """Changes whenever the database file, its WAL or any scores partition is rewritten."""
+    db = Path(db_path)
+    parts = []
+    for p in (db, db.with_name(db.name + ".wal"), *sorted(default_score_dir(db).glob("model=*/run_date=*"))):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        parts.append((p.name, st.st_ino, st.st_size, st.st_mtime_ns))
+    return tuple(parts)
+
+def render(df: pd.DataFrame, fmt: str) -> bytes:
+    if fmt == "csv":
+        return df.to_csv(index=False).encode()
+    df = df.copy()
+    for c in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = df[c].dt.strftime("%Y-%m-%d" if (df[c].dropna() == df[c].dropna().dt.normalize()).all() else "%Y-%m-%dT%H:%M:%S")
+    cols = list(df.columns)
+    rows = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+    return json.dumps({"columns": cols, "rows": rows}, default=_json_default).encode()
+
+def _json_default(v):
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, (date, pd.Timestamp)):
+        return v.isoformat()
+    return str(v)
+
+class _Handle:
+    """One opened pool and the warehouse version it reads; closed once retired and no query uses it."""
+
+    def __init__(self, db_path: str, size: int):
+        self.pool = CursorPool(db_path, size)
+        # taken while the file is held open, so no writer can have moved it since
+        self.version = warehouse_version(db_path)
+        self.users = 0
+        self.retired = False
+        self.last_used = time.monotonic()
+
+class KpiService:
+    def __init__(self, db_path: str, workers: int = 4, release_after: float = 30.0, max_cache_bytes: int = 64 << 20):
+        self.db_path = db_path
+        self.workers = workers
+        self.release_after = release_after
+        self.max_cache_bytes = max_cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kpi-query")
+        self._handle: _Handle | None = None
+        self._version = None
+        self._cache: OrderedDict[tuple, bytes] = OrderedDict()
+        self._cache_bytes = 0
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._open_lock = asyncio.Lock()
+        self.stats = Counter()
+
+    async def _current(self) -> _Handle:
+        """The pool for the warehouse as it is now, (re)opened if it was released or the warehouse changed.
+
+        The version stat, the open and the close of a retired pool run on the default executor, never on
+        the event loop; the lock makes requests arriving during an open wait for that one open.
+        """
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(None, warehouse_version, self.db_path)
+        h = self._handle
+        if h is not None and h.version == version:
+            return h
+        async with self._open_lock:
+            h = self._handle
+            if h is not None and h.version == version:
+                # opened by the request that held the lock first
+                return h
+            if h is not None:
+                self._handle = None
+                self._retire(h)
+            h = await loop.run_in_executor(None, _Handle, self.db_path, self.workers)
+            self._handle = h
+            if h.version != self._version:
+                self._version = h.version
+                self._cache.clear()
+                self._cache_bytes = 0
+                self.stats["reloads"] += 1
+            return h
+
+    @staticmethod
+    def _retire(h: _Handle) -> None:
+        """Stop handing out `h`; its pool is closed off the event loop once no query uses it."""
+        h.retired = True
+        if not h.users:
+            asyncio.get_running_loop().run_in_executor(None, h.pool.close)
+
+    def _cache_put(self, key: tuple, body: bytes) -> None:
+        if len(body) > self.max_cache_bytes // 4:
+            return
+        self._cache[key] = body
+        self._cache_bytes += len(body)
+        while self._cache_bytes > self.max_cache_bytes:
+            _, old = self._cache.popitem(last=False)
+            self._cache_bytes -= len(old)
+
+    async def query(self, path: str, params: dict[str, str], fmt: str, h: _Handle | None = None) -> tuple[bytes, str]:
+        """Response body for an endpoint call (on handle `h`, default: the current one) and how it was
+        served: hit, coalesced or miss."""
+        h = h or await self._current()
+        key = (h.version, path, tuple(sorted(params.items())), fmt)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key], "hit"
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key]), "coalesced"
+
+        fn = ENDPOINTS[path][0]
+
+        def work() -> bytes:
+            with h.pool.cursor() as cur:
+                df = fn(cur, self.db_path, params)
+            return render(df, fmt)
+
+        fut = asyncio.get_running_loop().run_in_executor(self._executor, work)
+        self._inflight[key] = fut
+        h.users += 1
+
+        def done(f: asyncio.Future) -> None:
+            # bookkeeping on completion rather than in the awaiting task, which a client disconnect can cancel
+            del self._inflight[key]
+            h.users -= 1
+            h.last_used = time.monotonic()
+            if h.retired and not h.users:
+                asyncio.get_running_loop().run_in_executor(None, h.pool.close)
+            elif h is self._handle and not f.cancelled() and f.exception() is None:
+                self._cache_put(key, f.result())
+
+        fut.add_done_callback(done)
+        return await asyncio.shield(fut), "miss"
+
+    @staticmethod
+    def etag(version: tuple, path: str, params: dict[str, str], fmt: str) -> str:
+        key = repr((version, path, sorted(params.items()), fmt))
+        return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+    def health(self) -> dict:
+        h = self._handle
+        return {
+            "status": "ok", "db_path": str(Path(self.db_path).resolve()), "workers": self.workers,
+            "pool_open": h is not None, "inflight": len(self._inflight),
+            "cache": {"entries": len(self._cache), "bytes": self._cache_bytes, "max_bytes": self.max_cache_bytes},
+            "requests": dict(self.stats), "endpoints": {p: sorted(a) for p, (_, a) in ENDPOINTS.items()},
+        }
+
+    async def respond(self, target: str, headers: dict[str, str]) -> tuple[int, dict[str, str], bytes]:
+        url = urlsplit(target)
+        pairs = parse_qsl(url.query)
+        params = {k: v for k, v in pairs if v != ""}
+        if url.path in ("/", "/health"):
+            return 200, {"Content-Type": FORMATS["json"]}, json.dumps(self.health()).encode()
+        if url.path not in ENDPOINTS:
+            return 404, {"Content-Type": FORMATS["json"]}, json.dumps({"error": f"Unknown endpoint {url.path}"}).encode()
+        fmt = params.pop("format", "json")
+        unknown = sorted(set(params) - ENDPOINTS[url.path][1])
+        if fmt not in FORMATS or unknown or len(pairs) != len(dict(pairs)):
+            msg = (f"Unknown parameter(s) {unknown}; accepted: {sorted(ENDPOINTS[url.path][1])} and format" if unknown
+                   else f"format must be one of {list(FORMATS)}" if fmt not in FORMATS else "Repeated parameter")
+            return 400, {"Content-Type": FORMATS["json"]}, json.dumps({"error": msg}).encode()
+
+        try:
+            h = await self._current()
+            etag = self.etag(h.version, url.path, params, fmt)
+            head = {"Content-Type": FORMATS[fmt], "ETag": etag, "Cache-Control": "no-cache"}
+            if headers.get("if-none-match") == etag:
+                # same warehouse version and request: the client's copy is current
+                self.stats["not_modified"] += 1
+                return 304, head, b""
+            body, how = await self.query(url.path, params, fmt, h)
+        except duckdb.IOException as e:
+            # the loader holds the write lock
+            return 503, {"Content-Type": FORMATS["json"], "Retry-After": "5"}, json.dumps({"error": str(e)}).encode()
+        except ValueError as e:
+            return 400, {"Content-Type": FORMATS["json"]}, json.dumps({"error": str(e)}).encode()
+        except FileNotFoundError as e:
+            return 404, {"Content-Type": FORMATS["json"]}, json.dumps({"error": str(e)}).encode()
+        self.stats[how] += 1
+        return 200, {**head, "X-Cache": how}, body
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """HTTP/1.1 GET with keep-alive: one request at a time per connection."""
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEPALIVE_SECONDS)
+                except (asyncio.TimeoutError, ConnectionError, ValueError):
+                    break
+                if not line.strip():
+                    break
+                headers = {}
+                while (h := await reader.readline()).strip():
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {}, b"", close=True)
+                    break
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                if method not in ("GET", "HEAD"):
+                    status, head, body = 405, {"Allow": "GET, HEAD"}, b""
+                else:
+                    try:
+                        status, head, body = await self.respond(target, headers)
+                    except Exception as e:
+                        print(f"[kpi_service] {target} failed: {type(e).__name__}: {e}")
+                        self.stats["errors"] += 1
+                        status, head, body = 500, {"Content-Type": FORMATS["json"]}, json.dumps({"error": "internal error"}).encode()
+                await self._send(writer, status, head, body if method == "GET" else b"", close, length=len(body))
+                if close:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _send(writer, status: int, headers: dict[str, str], body: bytes, close: bool, length: int | None = None) -> None:
+        head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Length: {len(body) if length is None else length}"]
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        head.append(f"Connection: {'close' if close else 'keep-alive'}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def release_idle(self) -> None:
+        """Close the pool after `release_after` idle seconds so the loader can take the write lock."""
+        while True:
+            await asyncio.sleep(min(1.0, self.release_after))
+            h = self._handle
+            if h is not None and not h.users and time.monotonic() - h.last_used > self.release_after:
+                self._handle = None
+                self._retire(h)
+
+    async def start(self, host: str, port: int) -> asyncio.Server:
+        """Listen on host:port (0: an ephemeral port, see server.sockets) without blocking."""
+        return await asyncio.start_server(self.handle_client, host, port)
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await self.start(host, port)
+        reaper = asyncio.create_task(self.release_idle()) if self.release_after > 0 else None
+        port = server.sockets[0].getsockname()[1]
+        print(f"Serving {self.db_path} on http://{host}:{port} ({self.workers} query workers); endpoints: {', '.join(ENDPOINTS)}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if reaper:
+                reaper.cancel()
+            if self._handle is not None and not self._handle.users:
+                self._handle.pool.close()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+# dashboard-like filter mix for `bench`: every tab, every single-filter value, a few combinations
+BENCH_PATHS = [
+    "/monitoring", "/funnel", "/experiments", "/top_creators?k=50", "/top_creators?model=churn&k=50",
+    *(f"/monitoring?tier={t}" for t in ("Small", "Mid", "Large")),
+    *(f"/monitoring?country={c}&by=experiment_group" for c in ("US", "CA", "GB", "AU", "DE")),
+    *(f"/funnel?by=tier&country={c}" for c in ("US", "CA", "GB", "AU", "DE")),
+    *(f"/funnel?by=country&tier={t}&experiment_group={g}" for t in ("Small", "Mid", "Large") for g in ("control", "treatment")),
+    *(f"/experiments?metric={m}" for m in experiments.METRICS),
+    *(f"/top_creators?tier={t}&k=100" for t in ("Small", "Mid", "Large")),
+]
+
+async def _bench_client(host: str, port: int, paths: list[str], n: int, rng: random.Random, latencies: list[float], served: Counter) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(n):
+            t0 = time.perf_counter()
+            writer.write(f"GET {rng.choice(paths)} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while (h := await reader.readline()).strip():
+                k, _, v = h.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            await reader.readexactly(int(headers.get("content-length", 0)))
+            latencies.append(time.perf_counter() - t0)
+            served[headers.get("x-cache", str(status)) if status == 200 else str(status)] += 1
+    finally:
+        writer.close()
+
+async def bench(host: str, port: int, clients: int, requests: int, seed: int = 7) -> dict:
+    """`clients` concurrent keep-alive connections each sending `requests` random BENCH_PATHS requests."""
+    latencies: list[float] = []
+    served: Counter = Counter()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(
+        _bench_client(host, port, BENCH_PATHS, requests, random.Random(seed + i), latencies, served) for i in range(clients)
+    ))
+    wall = time.perf_counter() - t0
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": len(ms), "seconds": round(wall, 3), "requests_per_s": round(len(ms) / wall, 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2), "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2), "max_ms": round(float(ms.max()), 2), "served": dict(served),
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", nargs="?", choices=["serve", "bench"], default="serve")
+    ap.add_argument("--db_path", type=str, default="warehouse.duckdb")
+    ap.add_argument("--host", type=str, default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--workers", type=int, default=4, help="concurrent DuckDB queries (read-only cursors)")
+    ap.add_argument("--cache_max_mb", type=int, default=64, help="response cache size")
+    ap.add_argument("--release_after", type=float, default=30.0,
+                    help="close the warehouse after this many idle seconds so loads can run (0: never)")
+    ap.add_argument("--clients", type=int, default=48, help="bench: concurrent connections")
+    ap.add_argument("--requests", type=int, default=50, help="bench: requests per connection")
+    args = ap.parse_args()
+    if args.command == "bench":
+        print(json.dumps(asyncio.run(bench(args.host, args.port, args.clients, args.requests)), indent=2))
+        return
+    service = KpiService(args.db_path, args.workers, args.release_after, args.cache_max_mb << 20)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
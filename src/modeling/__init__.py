@@ -1,2 +1,2 @@
-from .train_propensity import main as propensity_main
-from .train_churn import main as churn_main
+from .train_propensity import main as propensity_main, train as propensity_train, score as propensity_score
+from .train_churn import main as churn_main, train as churn_train, score as churn_score
@@ -0,0 +1,90 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from pathlib import Path
+import pandas as pd
+from src.utils.db import exec_sql, read_df, table_signature
+
+# bump when feature semantics change without the SQL text changing
+FEATURE_VERSION = 1
+
+SOURCE_TABLES = ["raw_creators", "raw_episodes", "raw_listening_events", "raw_revenue_events"]
+
+# creator features shared by the propensity and churn models
+CREATOR_FEATURES_SQL = r"""
+WITH last_day AS (
+  SELECT max(published_at::DATE) AS max_ds FROM raw_episodes
+),
+episodes AS (
+  SELECT
+    e.creator_id,
+    count(*) AS episodes_180d,
+    count(*) FILTER (WHERE e.published_at::DATE >= d.max_ds - INTERVAL 30 DAY) AS episodes_last_30d
+  FROM raw_episodes e
+  CROSS JOIN last_day d
+  GROUP BY 1
+),
+listens AS (
+  SELECT creator_id, sum(listens) AS listens_180d
+  FROM raw_listening_events
+  GROUP BY 1
+),
+rev AS (
+  SELECT creator_id, sum(revenue_usd) AS revenue_180d
+  FROM raw_revenue_events
+  GROUP BY 1
+)
+SELECT
+  c.creator_id,
+  c.tier::VARCHAR AS tier,
+  c.country::VARCHAR AS country,
+  c.experiment_group::VARCHAR AS experiment_group,
+  c.eligible,
+  c.enrolled,
+  coalesce(e.episodes_last_30d,0) AS episodes_last_30d,
+  coalesce(e.episodes_180d,0) AS episodes_180d,
+  coalesce(l.listens_180d,0) AS listens_180d,
+  coalesce(r.revenue_180d,0) AS revenue_180d
+FROM raw_creators c
+LEFT JOIN episodes e USING(creator_id)
+LEFT JOIN listens l USING(creator_id)
+LEFT JOIN rev r USING(creator_id)
+ORDER BY c.creator_id
+"""
+
+# concurrent trainers asking for the same fingerprint compute it once
+_locks: dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+def default_cache_dir(db_path: str | Path) -> Path:
+    return Path(db_path).resolve().parent / "feature_store"
+
+def fingerprint(con) -> str:
+    h = hashlib.sha256(f"v{FEATURE_VERSION}\n{CREATOR_FEATURES_SQL}".encode())
+    for t in SOURCE_TABLES:
+        h.update(f"\n{t}={table_signature(con, t)}".encode())
+    return h.hexdigest()[:16]
+
+def materialize(con, cache_dir: Path) -> Path:
+    """Path of the creator feature Parquet for the warehouse's current state, computing it if missing."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fp = fingerprint(con)
+    path = cache_dir / f"creator_features_{fp}.parquet"
+    with _locks_guard:
+        lock = _locks.setdefault(fp, threading.Lock())
+    with lock:
+        if not path.exists():
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            exec_sql(con, f"COPY ({CREATOR_FEATURES_SQL}) TO '{tmp}' (FORMAT PARQUET);", name="creator_features")
+            os.replace(tmp, path)
+            print(f"Feature store: built {path.name}")
+    return path
+
+def features_sql(con, db_path: str | Path, cache_dir: str | Path | None = None) -> str:
+    """SQL over the cached creator features, for streaming reads."""
+    cache_dir = Path(cache_dir) if cache_dir else default_cache_dir(db_path)
+    return f"SELECT * FROM read_parquet('{materialize(con, cache_dir)}')"
+
+def creator_features(con, db_path: str | Path, cache_dir: str | Path | None = None) -> pd.DataFrame:
+    return read_df(con, features_sql(con, db_path, cache_dir), name="read creator_features")
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder, StandardScaler
+from src.utils.db import read_batches
+from src.utils.stats import binned_auc
+from src.utils.trace import span
+
+# Out-of-core training: features are streamed from DuckDB in batches and never held in full.
+# One pass fits the encoders (categories, numeric mean/std), then `epochs` shuffled passes feed
+# SGDClassifier.partial_fit. Holdout = creators with hash(creator_id) % TEST_BUCKETS = 0.
+TEST_BUCKETS = 4
+AUC_BINS = 1 << 16
+# A creator's split depends only on its id, so it is the same in every run and every training mode;
+# the in-memory trainers use it too (holdout_mask), and warm starts require it (registry).
+HOLDOUT = f"hash(creator_id) % {TEST_BUCKETS} = 0"
+
+def split_sql(sql: str, test: bool, order_seed: int | None = None) -> str:
+    """Train or holdout rows of `sql`, optionally in a seeded pseudo-random order."""
+    where = HOLDOUT if test else f"NOT ({HOLDOUT})"
+    order = f" ORDER BY hash(creator_id, {order_seed})" if order_seed is not None else ""
+    return f"SELECT * FROM ({sql}) WHERE {where}{order}"
+
+def holdout_mask(con, creator_ids: pd.Series) -> np.ndarray:
+    """Per row, whether the creator is in split_sql's holdout (hashed by DuckDB, so both splits agree)."""
+    ids = pa.table({"creator_id": creator_ids.to_numpy(dtype=np.int64)})
+    return con.from_arrow(ids).project(f"{HOLDOUT} AS holdout").fetchnumpy()["holdout"].astype(bool)
+
+def _standardize(X, mean, scale):
+    return (np.asarray(X, dtype=float) - mean) / scale
+
+def fit_encoders(con, sql: str, cat_cols: list[str], num_cols: list[str], batch_size: int) -> tuple[ColumnTransformer, dict]:
+    """Stream `sql` once to learn one-hot categories and numeric mean/std.
+
+    Returns a preprocessor with all state fixed up front (explicit categories, constant
+    standardization), so fitting it on any batch is equivalent, plus the registry schema.
+    """
+    cats: dict[str, set] = {c: set() for c in cat_cols}
+    scaler = StandardScaler()
+    n = 0
+    for batch in read_batches(con, sql, batch_size):
+        X = batch.to_pandas()
+        if X.empty:
+            continue
+        for c in cat_cols:
+            cats[c].update(X[c].dropna().astype(str).unique())
+        scaler.partial_fit(X[num_cols].to_numpy(dtype=float))
+        n += len(X)
+    if not n:
+        raise ValueError("No training rows")
+    categories = {c: sorted(v) for c, v in cats.items()}
+    pre = ColumnTransformer([
+        ("cat", OneHotEncoder(categories=[categories[c] for c in cat_cols], handle_unknown="ignore"), cat_cols),
+        ("num", FunctionTransformer(_standardize, kw_args={"mean": scaler.mean_, "scale": scaler.scale_},
+                                    feature_names_out="one-to-one"), num_cols),
+    ])
+    return pre, {"cat_cols": cat_cols, "num_cols": num_cols, "categories": categories}
+
+def build_pipeline(pre: ColumnTransformer, seed: int = 7) -> Pipeline:
+    # averaging smooths the SGD iterates; without it the holdout AUC swings between epochs
+    clf = SGDClassifier(loss="log_loss", alpha=1e-4, average=True, random_state=seed)
+    return Pipeline([("pre", pre), ("clf", clf)])
+
+def partial_fit(con, pipe: Pipeline, sql: str, label: str, epochs: int, batch_size: int) -> int:
+    """Run `epochs` passes of partial_fit over the training split of `sql`; returns rows per epoch."""
+    pre, clf = pipe.named_steps["pre"], pipe.named_steps["clf"]
+    n = 0
+    for epoch in range(epochs):
+        n = 0
+        with span("epoch", epoch=epoch) as attrs:
+            for batch in read_batches(con, split_sql(sql, test=False, order_seed=epoch), batch_size):
+                X = batch.to_pandas()
+                if X.empty:
+                    continue
+                if not hasattr(pre, "transformers_"):
+                    pre.fit(X)
+                clf.partial_fit(pre.transform(X), X[label].to_numpy(dtype=int), classes=[0, 1])
+                n += len(X)
+            if attrs is not None:
+                attrs["rows"] = n
+    return n
+
+def evaluate(con, pipe: Pipeline, sql: str, label: str, batch_size: int, threshold: float = 0.5) -> dict:
+    """Holdout ROC-AUC (from score histograms) and confusion counts, streamed batch by batch."""
+    pos, neg = np.zeros(AUC_BINS, dtype=np.int64), np.zeros(AUC_BINS, dtype=np.int64)
+    tp = fp = fn = tn = 0
+    for batch in read_batches(con, split_sql(sql, test=True), batch_size):
+        X = batch.to_pandas()
+        if X.empty:
+            continue
+        y = X[label].to_numpy(dtype=int)
+        proba = pipe.predict_proba(X)[:, 1]
+        bins = np.minimum((proba * AUC_BINS).astype(np.int64), AUC_BINS - 1)
+        pos += np.bincount(bins[y == 1], minlength=AUC_BINS)
+        neg += np.bincount(bins[y == 0], minlength=AUC_BINS)
+        pred = proba >= threshold
+        tp += int((pred & (y == 1)).sum())
+        fp += int((pred & (y == 0)).sum())
+        fn += int((~pred & (y == 1)).sum())
+        tn += int((~pred & (y == 0)).sum())
+    return {"roc_auc": binned_auc(pos, neg), "n_test": tp + fp + fn + tn, "tp": tp, "fp": fp, "fn": fn, "tn": tn}
+
+def report(m: dict) -> str:
+    """classification_report-style table from confusion counts."""
+    rows = []
+    for name, hit, pred_n, true_n in (("0", m["tn"], m["tn"] + m["fn"], m["tn"] + m["fp"]),
+                                      ("1", m["tp"], m["tp"] + m["fp"], m["tp"] + m["fn"])):
+        p = hit / pred_n if pred_n else 0.0
+        r = hit / true_n if true_n else 0.0
+        f = 2 * p * r / (p + r) if p + r else 0.0
+        rows.append(f"{name:>12} {p:>9.2f} {r:>9.2f} {f:>9.2f} {true_n:>9}")
+    acc = (m["tp"] + m["tn"]) / m["n_test"] if m["n_test"] else 0.0
+    return "\n".join([f"{'':>12} {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}", "", *rows, "",
+                      f"{'accuracy':>12} {'':>9} {'':>9} {acc:>9.2f} {m['n_test']:>9}"])
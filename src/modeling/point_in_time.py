@@ -0,0 +1,145 @@
+from __future__ import annotations
+import argparse
+from datetime import date, timedelta
+from pathlib import Path
+import pandas as pd
+from src.utils.db import export, maybe_connect, read_df
+from src.utils.trace import traced
+
+FEATURE_DAYS = 180
+RECENT_DAYS = 30
+LABEL_DAYS = 30
+
+# Creator features from data strictly before each as_of date, labels from [as_of, as_of + label_days).
+# The fact tables are scanned once into per-creator running totals; every (creator, as_of) row then
+# reads window sums as differences of the totals found by ASOF joins at the window edges, so adding
+# cutoffs adds lookups, not scans.
+PIT_SQL = r"""
+WITH cutoffs AS (
+  SELECT unnest([{cutoffs}])::DATE AS as_of
+),
+daily AS (
+  SELECT creator_id, ds, sum(episodes) AS episodes, sum(listens) AS listens, sum(revenue_usd) AS revenue_usd
+  FROM (
+    SELECT creator_id, published_at::DATE AS ds, 1 AS episodes, 0 AS listens, 0.0 AS revenue_usd FROM raw_episodes
+    UNION ALL
+    SELECT creator_id, event_date::DATE, 0, listens, 0.0 FROM raw_listening_events
+    UNION ALL
+    SELECT creator_id, event_date::DATE, 0, 0, revenue_usd FROM raw_revenue_events
+  )
+  GROUP BY ALL
+),
+running AS (
+  SELECT
+    creator_id,
+    ds,
+    sum(episodes) OVER w AS episodes,
+    sum(listens) OVER w AS listens,
+    sum(revenue_usd) OVER w AS revenue_usd
+  FROM daily
+  WINDOW w AS (PARTITION BY creator_id ORDER BY ds ROWS UNBOUNDED PRECEDING)
+),
+stages AS (
+  SELECT
+    creator_id,
+    min(event_ts) FILTER (WHERE event_name = 'eligible') AS eligible_ts,
+    min(event_ts) FILTER (WHERE event_name = 'enroll') AS enroll_ts
+  FROM raw_creator_events
+  GROUP BY 1
+),
+grid AS (
+  SELECT
+    c.creator_id,
+    t.as_of,
+    c.tier::VARCHAR AS tier,
+    c.country::VARCHAR AS country,
+    c.experiment_group::VARCHAR AS experiment_group,
+    s.eligible_ts,
+    s.enroll_ts
+  FROM raw_creators c
+  CROSS JOIN cutoffs t
+  LEFT JOIN stages s USING(creator_id)
+  WHERE c.created_at < t.as_of
+),
+-- running totals strictly before each window edge; creators with no activity at all skip the lookups
+edges AS (
+  SELECT
+    g.*,
+    now_.episodes AS e0, now_.listens AS l0, now_.revenue_usd AS r0,
+    recent.episodes AS e_recent,
+    hist.episodes AS e_hist, hist.listens AS l_hist, hist.revenue_usd AS r_hist,
+    fut.episodes AS e_fut
+  FROM (SELECT * FROM grid WHERE creator_id IN (SELECT creator_id FROM daily)) g
+  ASOF LEFT JOIN running now_ ON now_.creator_id = g.creator_id AND now_.ds < g.as_of
+  ASOF LEFT JOIN running recent ON recent.creator_id = g.creator_id AND recent.ds < g.as_of - {recent_days}
+  ASOF LEFT JOIN running hist ON hist.creator_id = g.creator_id AND hist.ds < g.as_of - {feature_days}
+  ASOF LEFT JOIN running fut ON fut.creator_id = g.creator_id AND fut.ds < g.as_of + {label_days}
+  UNION ALL BY NAME
+  SELECT * FROM grid WHERE creator_id NOT IN (SELECT creator_id FROM daily)
+)
+SELECT
+  as_of,
+  creator_id,
+  tier,
+  country,
+  experiment_group,
+  CASE WHEN eligible_ts < as_of THEN 1 ELSE 0 END AS eligible,
+  CASE WHEN enroll_ts < as_of THEN 1 ELSE 0 END AS enrolled,
+  (coalesce(e0, 0) - coalesce(e_recent, 0))::BIGINT AS episodes_last_30d,
+  (coalesce(e0, 0) - coalesce(e_hist, 0))::BIGINT AS episodes_180d,
+  (coalesce(l0, 0) - coalesce(l_hist, 0))::BIGINT AS listens_180d,
+  coalesce(r0, 0) - coalesce(r_hist, 0) AS revenue_180d,
+  -- labels: no episode in the label window / enrolled during it
+  CASE WHEN coalesce(e_fut, 0) = coalesce(e0, 0) THEN 1 ELSE 0 END AS label_churn,
+  CASE WHEN enroll_ts >= as_of AND enroll_ts < as_of + {label_days} THEN 1 ELSE 0 END AS label_enroll
+FROM edges
+ORDER BY as_of, creator_id
+"""
+
+def data_range(con) -> tuple[date, date]:
+    return con.execute("SELECT min(published_at)::DATE, max(published_at)::DATE FROM raw_episodes").fetchone()
+
+def weekly_as_of(con, n: int = 26, label_days: int = LABEL_DAYS) -> list[date]:
+    """The last `n` weekly cutoffs whose label window is fully inside the data."""
+    lo, hi = data_range(con)
+    last = hi - timedelta(days=label_days - 1)
+    dates = [last - timedelta(weeks=i) for i in range(n)]
+    return sorted(d for d in dates if d > lo)
+
+def pit_sql(con, as_of: list[date], feature_days: int = FEATURE_DAYS, recent_days: int = RECENT_DAYS,
+            label_days: int = LABEL_DAYS) -> str:
+    if not as_of:
+        raise ValueError("No as_of dates given")
+    _, hi = data_range(con)
+    late = [d for d in as_of if d + timedelta(days=label_days - 1) > hi]
+    if late:
+        raise ValueError(f"Label window of {[str(d) for d in late]} runs past the last data date {hi}")
+    cutoffs = ", ".join(f"DATE '{d}'" for d in sorted(set(as_of)))
+    return PIT_SQL.format(cutoffs=cutoffs, feature_days=feature_days, recent_days=recent_days, label_days=label_days)
+
+@traced("point_in_time.build")
+def build(con, as_of: list[date], **windows) -> pd.DataFrame:
+    """One row per (as_of, creator existing before as_of) with point-in-time features and labels."""
+    return read_df(con, pit_sql(con, as_of, **windows), name="point_in_time")
+
+@traced("point_in_time.export")
+def build_to(con, as_of: list[date], path: str | Path, **windows) -> Path:
+    """Write the training set straight to CSV/Parquet (by suffix) without materializing it in Python."""
+    return export(con, pit_sql(con, as_of, **windows), path, name="point_in_time")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db_path", type=str, default="warehouse.duckdb")
+    ap.add_argument("--out", type=str, default="outputs/training_set_pit.parquet")
+    ap.add_argument("--as_of", nargs="+", default=None, help="cutoff dates (YYYY-MM-DD); default: weekly")
+    ap.add_argument("--weeks", type=int, default=26, help="number of weekly cutoffs when --as_of is not given")
+    ap.add_argument("--label_days", type=int, default=LABEL_DAYS)
+    args = ap.parse_args()
+
+    with maybe_connect(args.db_path) as con:
+        as_of = [date.fromisoformat(d) for d in args.as_of] if args.as_of else weekly_as_of(con, args.weeks, args.label_days)
+        path = build_to(con, as_of, args.out, label_days=args.label_days)
+    print(f"Wrote point-in-time training set for {len(as_of)} cutoffs ({as_of[0]} .. {as_of[-1]}): {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from __future__ import annotations
+import copy
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+import joblib
+import pandas as pd
+
+# trees added per warm-started refit of a forest, and the size at which it is refit from scratch
+WARM_TREES = 50
+MAX_TREES = 500
+
+def default_registry_dir(db_path: str | Path) -> Path:
+    return Path(db_path).resolve().parent / "models"
+
+def feature_schema(X: pd.DataFrame, cat_cols: list[str], num_cols: list[str]) -> dict:
+    return {
+        "cat_cols": cat_cols,
+        "num_cols": num_cols,
+        "categories": {c: sorted(map(str, X[c].dropna().unique())) for c in cat_cols},
+    }
+
+def training_fingerprint(data_fingerprint: str, pipe, schema: dict, split: str) -> str:
+    """Identity of a fit: the training data, the estimator settings, the feature schema and the train/holdout split."""
+    params = {k: v for k, v in pipe.named_steps["clf"].get_params().items() if k not in ("warm_start", "n_estimators")}
+    payload = json.dumps({"data": data_fingerprint, "params": repr(sorted(params.items())), "schema": schema,
+                          "split": split}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def save(name: str, pipe, meta: dict, registry_dir: Path) -> Path:
+    """Persist a fitted pipeline plus metadata and point `latest` at it."""
+    model_dir = registry_dir / name
+    model_dir.mkdir(parents=True, exist_ok=True)
+    version = datetime.now().strftime("%Y%m%dT%H%M%S") + "-" + meta["fingerprint"]
+    path = model_dir / f"{version}.joblib"
+    joblib.dump(pipe, path)
+    meta = {**meta, "version": version, "path": path.name, "saved_at": datetime.now().isoformat(timespec="seconds")}
+    (model_dir / f"{version}.json").write_text(json.dumps(meta, indent=2, default=str), encoding="utf-8")
+    tmp = model_dir / f".latest.{os.getpid()}.tmp"
+    tmp.write_text(json.dumps(meta, indent=2, default=str), encoding="utf-8")
+    os.replace(tmp, model_dir / "latest.json")
+    return path
+
+def load_latest(name: str, registry_dir: Path):
+    """(pipeline, meta) of the latest saved model, or (None, None)."""
+    latest = registry_dir / name / "latest.json"
+    if not latest.exists():
+        return None, None
+    meta = json.loads(latest.read_text(encoding="utf-8"))
+    return joblib.load(registry_dir / name / meta["path"]), meta
+
+def warm_start_from(pipe, prev_pipe, prev_meta: dict | None, schema: dict, split: str) -> bool:
+    """Seed pipe's classifier from the previous fit when the estimator supports it, the encoded
+    feature space is unchanged and both fits use the same per-creator `split`. Forests keep their
+    trees and add WARM_TREES new ones.
+
+    The split must be stable (a function of creator_id, e.g. incremental.HOLDOUT): kept trees or
+    coefficients were fit on the previous train rows, and with a reshuffled split some of those
+    would land in the new holdout and inflate its ROC-AUC.
+    """
+    if prev_pipe is None or prev_meta is None or prev_meta.get("schema") != schema or prev_meta.get("split") != split:
+        return False
+    prev_clf = prev_pipe.named_steps["clf"]
+    clf = pipe.named_steps["clf"]
+    if type(prev_clf) is not type(clf) or "warm_start" not in clf.get_params():
+        return False
+    warm = copy.deepcopy(prev_clf)
+    if "n_estimators" in warm.get_params():
+        if warm.n_estimators + WARM_TREES > MAX_TREES:
+            return False
+        warm.set_params(n_estimators=warm.n_estimators + WARM_TREES)
+    warm.set_params(warm_start=True)
+    pipe.steps[-1] = ("clf", warm)
+    return True
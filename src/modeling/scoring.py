@@ -0,0 +1,86 @@
+from __future__ import annotations
+import heapq
+import shutil
+from datetime import date
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.utils.db import is_read_only, read_batches, table_exists
+from src.utils.trace import span
+
+# Every score lives in score_dir/model=<model>/run_date=<run_date>/part-<i>.parquet; creator_scores is a
+# view over those partitions, so runs on read-only connections are queryable too. DuckDB resolves
+# the glob when the view is created (at least one partition must exist), then again on every query.
+SCORES_VIEW = "creator_scores"
+SCORES_VIEW_SQL = r"""
+SELECT model, run_date, creator_id, score
+FROM read_parquet('{score_dir}/model=*/run_date=*/*.parquet', hive_partitioning = true)
+"""
+
+def default_score_dir(db_path: str | Path) -> Path:
+    return Path(db_path).resolve().parent / "creator_scores"
+
+def publish_scores(con, score_dir: Path) -> bool:
+    """(Re)define the creator_scores view on a writable connection; False if nothing was scored yet."""
+    if not any(Path(score_dir).glob("model=*/run_date=*/*.parquet")):
+        return False
+    # warehouses from before the view held scores in a table of the same name
+    if table_exists(con, SCORES_VIEW):
+        con.execute(f"DROP TABLE {SCORES_VIEW};")
+    con.execute(f"CREATE OR REPLACE VIEW {SCORES_VIEW} AS {SCORES_VIEW_SQL.format(score_dir=Path(score_dir).resolve())};")
+    return True
+
+def score_stream(
+    con,
+    pipe,
+    sql: str,
+    model: str,
+    score_col: str,
+    score_dir: Path,
+    keep_cols: list[str] | None = None,
+    k: int = 2000,
+    batch_size: int = 100_000,
+    run_date: date | None = None,
+) -> tuple[pd.DataFrame, int]:
+    """Score `sql` rows batch by batch; return the top-k rows by score and the number scored.
+
+    Every score is written to score_dir/model=<model>/run_date=<run_date>/part-<i>.parquet as it is
+    produced; a writable `con` also (re)defines the creator_scores view. Memory is one batch plus
+    the k-row heap.
+    """
+    run_date = run_date or date.today()
+    part_dir = score_dir / f"model={model}" / f"run_date={run_date:%Y-%m-%d}"
+    shutil.rmtree(part_dir, ignore_errors=True)
+    part_dir.mkdir(parents=True, exist_ok=True)
+
+    heap: list[tuple[float, int, tuple]] = []
+    cols = None
+    n = 0
+    for i, batch in enumerate(read_batches(con, sql, batch_size)):
+        X = batch.to_pandas()
+        if X.empty:
+            continue
+        with span("predict", rows=len(X)):
+            proba = pipe.predict_proba(X)[:, 1]
+        ids = X["creator_id"].to_numpy()
+        n += len(X)
+        pq.write_table(pa.table({"creator_id": ids, "score": proba}), part_dir / f"part-{i:05d}.parquet")
+
+        # only this batch's own top-k can enter the global top-k
+        cols = (keep_cols or list(X.columns)) + [score_col]
+        cand = np.argpartition(-proba, min(k, len(proba)) - 1)[:k]
+        rows = X[keep_cols or list(X.columns)].iloc[cand].itertuples(index=False, name=None)
+        for j, row in zip(cand, rows):
+            item = (float(proba[j]), -int(ids[j]), row + (float(proba[j]),))
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    if not is_read_only(con):
+        publish_scores(con, score_dir)
+
+    top = [row for _, _, row in sorted(heap, reverse=True)]
+    return pd.DataFrame(top, columns=cols), n
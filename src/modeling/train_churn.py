@@ -3,99 +3,127 @@ import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score, classification_report
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestClassifier
-from src.utils.db import connect, read_df
-
-# churn label: no episodes in last 30 days (proxy)
-SQL = r"""
-WITH last_day AS (
-  SELECT max(published_at::DATE) AS max_ds FROM raw_episodes
-),
-episodes_30d AS (
-  SELECT
-    e.creator_id,
-    count(*) AS episodes_last_30d
-  FROM raw_episodes e
-  CROSS JOIN last_day d
-  WHERE e.published_at::DATE >= d.max_ds - INTERVAL 30 DAY
-  GROUP BY 1
-),
-episodes_180d AS (
-  SELECT creator_id, count(*) AS episodes_180d
-  FROM raw_episodes
-  GROUP BY 1
-),
-listens_180d AS (
-  SELECT creator_id, sum(listens) AS listens_180d
-  FROM raw_listening_events
-  GROUP BY 1
-)
-SELECT
-  c.creator_id,
-  c.tier,
-  c.country,
-  c.experiment_group,
-  coalesce(e30.episodes_last_30d,0) AS episodes_last_30d,
-  coalesce(e180.episodes_180d,0) AS episodes_180d,
-  coalesce(l180.listens_180d,0) AS listens_180d,
-  CASE WHEN coalesce(e30.episodes_last_30d,0)=0 THEN 1 ELSE 0 END AS label_churn
-FROM raw_creators c
-LEFT JOIN episodes_30d e30 USING(creator_id)
-LEFT JOIN episodes_180d e180 USING(creator_id)
-LEFT JOIN listens_180d l180 USING(creator_id);
-"""
+from src.utils.db import export, maybe_connect
+from src.utils.trace import span, traced
+from src.modeling import incremental, registry
+from src.modeling.feature_store import creator_features, features_sql, fingerprint as feature_fingerprint
+from src.modeling.scoring import score_stream, default_score_dir
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--db_path", type=str, default="warehouse.duckdb")
-    ap.add_argument("--out_dir", type=str, default="outputs")
-    args = ap.parse_args()
-
-    out_dir = Path(args.out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    con = connect(args.db_path)
-    df = read_df(con, SQL)
-    con.close()
-
-    y = df["label_churn"].astype(int)
-    X = df.drop(columns=["label_churn"])
-
-    cat_cols = ["tier", "country", "experiment_group"]
-    num_cols = ["episodes_last_30d", "episodes_180d", "listens_180d"]
+MODEL_NAME = "churn"
+CAT_COLS = ["tier", "country", "experiment_group"]
+NUM_COLS = ["episodes_last_30d", "episodes_180d", "listens_180d"]
 
+def build_pipeline() -> Pipeline:
     pre = ColumnTransformer([
-        ("cat", OneHotEncoder(handle_unknown="ignore"), cat_cols),
-        ("num", "passthrough", num_cols),
+        ("cat", OneHotEncoder(handle_unknown="ignore"), CAT_COLS),
+        ("num", "passthrough", NUM_COLS),
     ])
 
     clf = RandomForestClassifier(
         n_estimators=250, random_state=7, n_jobs=-1, max_depth=10, min_samples_leaf=20
     )
-    pipe = Pipeline([("pre", pre), ("clf", clf)])
+    return Pipeline([("pre", pre), ("clf", clf)])
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=7, stratify=y)
+# classifier settings searched by `python -m src.modeling.tune churn`
+PARAM_GRID = {
+    "max_depth": [6, 10, 16, None],
+    "min_samples_leaf": [5, 20, 50],
+    "max_features": ["sqrt", 0.5],
+}
+
+def training_data(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """(X, y) from creator features; churn label: no episodes in last 30 days (proxy)."""
+    X = df[["creator_id", *CAT_COLS, *NUM_COLS]]
+    return X, (X["episodes_last_30d"] == 0).astype(int)
+
+@traced("churn.score")
+def score(db_path: str, out_dir: Path, con=None, top_k: int = 2000, batch_size: int = 100_000, pipe=None) -> int:
+    """Score all creators with `pipe` (default: the latest registered model) and export the top-k at risk."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if pipe is None:
+        pipe, _ = registry.load_latest(MODEL_NAME, registry.default_registry_dir(db_path))
+        if pipe is None:
+            raise FileNotFoundError(f"No saved {MODEL_NAME} model under {registry.default_registry_dir(db_path)}; run train first")
 
-    pipe.fit(X_train, y_train)
-    proba = pipe.predict_proba(X_test)[:,1]
-    auc = roc_auc_score(y_test, proba)
-    preds = (proba >= 0.5).astype(int)
-    report = classification_report(y_test, preds, output_dict=False)
+    with maybe_connect(db_path, con) as db:
+        score_sql = f"""
+        SELECT creator_id, tier, country, experiment_group, episodes_last_30d, episodes_180d, listens_180d,
+          CASE WHEN episodes_last_30d = 0 THEN 1 ELSE 0 END AS label_churn
+        FROM ({features_sql(db, db_path)})
+        """
+        top, n_scored = score_stream(
+            db, pipe, score_sql, model=MODEL_NAME, score_col="p_churn", score_dir=default_score_dir(db_path),
+            k=top_k, batch_size=batch_size,
+        )
+        export(db, top, out_dir / "top_at_risk_creators_churn.csv")
+    return n_scored
+
+@traced("churn.train")
+def train(db_path: str, out_dir: Path, con=None, top_k: int = 2000, batch_size: int = 100_000, force: bool = False):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with maybe_connect(db_path, con) as db:
+        with span("features"):
+            df = creator_features(db, db_path)
+        data_fp = feature_fingerprint(db)
+        X, y = training_data(df)
+        holdout = incremental.holdout_mask(db, X["creator_id"])
+
+    pipe = build_pipeline()
+    schema = registry.feature_schema(X, CAT_COLS, NUM_COLS)
+    fp = registry.training_fingerprint(data_fp, pipe, schema, incremental.HOLDOUT)
+    reg_dir = registry.default_registry_dir(db_path)
+    prev, prev_meta = registry.load_latest(MODEL_NAME, reg_dir)
+
+    if prev is not None and prev_meta["fingerprint"] == fp and not force:
+        # same data, settings and schema as the saved model: reuse it
+        pipe, auc, report = prev, prev_meta["metrics"]["roc_auc"], prev_meta["report"]
+        print(f"Churn model unchanged ({prev_meta['version']}); skipping fit")
+    else:
+        # forests warm-start by keeping the saved trees and growing WARM_TREES more on the new data
+        warm = registry.warm_start_from(pipe, prev, prev_meta, schema, incremental.HOLDOUT)
+        # the same creators are held out in every run, so kept trees/coefficients never saw the holdout
+        X_train, X_test, y_train, y_test = X[~holdout], X[holdout], y[~holdout], y[holdout]
+
+        with span("fit", rows=len(X_train), warm_start=warm):
+            pipe.fit(X_train, y_train)
+        proba = pipe.predict_proba(X_test)[:,1]
+        auc = roc_auc_score(y_test, proba)
+        preds = (proba >= 0.5).astype(int)
+        report = classification_report(y_test, preds, output_dict=False)
+        registry.save(MODEL_NAME, pipe, {
+            "fingerprint": fp, "data_fingerprint": data_fp, "schema": schema, "split": incremental.HOLDOUT,
+            "warm_start": warm, "metrics": {"roc_auc": auc, "n_train": len(X_train), "n_test": len(X_test)}, "report": report,
+        }, reg_dir)
 
     (out_dir / "churn_model_report.txt").write_text(
         f"ROC-AUC: {auc:.4f}\n\n{report}\n", encoding="utf-8"
     )
 
-    df["p_churn"] = pipe.predict_proba(X)[:,1]
-    df.sort_values("p_churn", ascending=False).head(2000).to_csv(out_dir / "top_at_risk_creators_churn.csv", index=False)
+    n_scored = score(db_path, out_dir, con, top_k, batch_size, pipe=pipe)
 
-    print(f"Churn model ROC-AUC: {auc:.4f}")
+    print(f"Churn model ROC-AUC: {auc:.4f} (scored {n_scored:,} creators)")
     print(f"Wrote: {out_dir/'churn_model_report.txt'}")
 
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", nargs="?", choices=["train", "score"], default="train")
+    ap.add_argument("--db_path", type=str, default="warehouse.duckdb")
+    ap.add_argument("--out_dir", type=str, default="outputs")
+    ap.add_argument("--force", action="store_true", help="refit even if the saved model is current")
+    args = ap.parse_args()
+    if args.command == "score":
+        n = score(args.db_path, Path(args.out_dir))
+        print(f"Scored {n:,} creators with the saved {MODEL_NAME} model")
+    else:
+        train(args.db_path, Path(args.out_dir), force=args.force)
+
 if __name__ == "__main__":
     main()
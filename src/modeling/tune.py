@@ -0,0 +1,146 @@
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.ensemble import BaseEnsemble
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from threadpoolctl import threadpool_limits
+from src.utils.db import maybe_connect
+from src.utils.trace import span
+from src.modeling import train_churn, train_propensity
+from src.modeling.feature_store import creator_features, fingerprint as feature_fingerprint
+
+# Cross-validated hyperparameter search. The encoded feature matrix is written once as a float32
+# .npy and every worker process maps it read-only, so the data is in RAM (page cache) once however
+# many workers run; a fit only copies its own fold's training rows.
+MODELS = {"propensity": train_propensity, "churn": train_churn}
+
+SEED = 7
+# successive halving: keep the best 1/FACTOR candidates per round on FACTOR x more rows
+FACTOR = 3
+MIN_ROWS_PER_FOLD = 200
+
+def default_tuning_dir(db_path: str | Path) -> Path:
+    return Path(db_path).resolve().parent / "tuning"
+
+def materialize(db_path: str, model: str, con=None, tuning_dir: Path | None = None) -> tuple[Path, Path]:
+    """Encode the model's training data once into X/y .npy files (rows in a seeded shuffled order)."""
+    mod = MODELS[model]
+    tuning_dir = tuning_dir or default_tuning_dir(db_path)
+    tuning_dir.mkdir(parents=True, exist_ok=True)
+    with maybe_connect(db_path, con) as db:
+        fp = feature_fingerprint(db)
+        x_path, y_path = tuning_dir / f"{model}_{fp}_X.npy", tuning_dir / f"{model}_{fp}_y.npy"
+        if x_path.exists() and y_path.exists():
+            return x_path, y_path
+        with span("features"):
+            X, y = mod.training_data(creator_features(db, db_path))
+
+    with span("encode", rows=len(X)):
+        Xt = mod.build_pipeline().named_steps["pre"].fit_transform(X)
+        Xt = (Xt.toarray() if sparse.issparse(Xt) else np.asarray(Xt)).astype(np.float32)
+    # shuffled once so any prefix is a random subsample (halving rounds use X[:n] views)
+    order = np.random.default_rng(SEED).permutation(len(Xt))
+    for path, arr in ((x_path, np.ascontiguousarray(Xt[order])), (y_path, y.to_numpy(dtype=np.int8)[order])):
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp.npy")
+        np.save(tmp, arr)
+        os.replace(tmp, path)
+    return x_path, y_path
+
+_X: np.ndarray | None = None
+_y: np.ndarray | None = None
+
+def _init_worker(x_path: str, y_path: str, threads: int) -> None:
+    global _X, _y
+    _X = np.load(x_path, mmap_mode="r")
+    _y = np.load(y_path, mmap_mode="r")
+    # BLAS/OpenMP pools inside the worker stay within its share of the cores
+    threadpool_limits(threads)
+    # the small early halving rounds rarely converge fully; one warning per fit would drown the output
+    warnings.simplefilter("ignore", ConvergenceWarning)
+
+def _fit_fold(clf, n_rows: int, fold: int, folds: int) -> tuple[float, float]:
+    """(holdout AUC, fit seconds) for one fold of the first n_rows rows."""
+    y = np.asarray(_y[:n_rows])
+    train_idx, test_idx = list(StratifiedKFold(folds, shuffle=True, random_state=SEED).split(np.zeros(n_rows), y))[fold]
+    X = _X[:n_rows]
+    t0 = time.perf_counter()
+    clf.fit(X[train_idx], y[train_idx])
+    secs = time.perf_counter() - t0
+    return float(roc_auc_score(y[test_idx], clf.predict_proba(X[test_idx])[:, 1])), secs
+
+def search(model: str, x_path: Path, y_path: Path, method: str = "halving", folds: int = 5,
+           workers: int | None = None, grid: dict | None = None) -> pd.DataFrame:
+    """Leaderboard of every (round, candidate): params, CV ROC-AUC mean/std and mean fit seconds."""
+    mod = MODELS[model]
+    candidates = list(ParameterGrid(grid or mod.PARAM_GRID))
+    n = len(np.load(y_path, mmap_mode="r"))
+    workers = workers or os.cpu_count() or 1
+    # tree parallelism per worker, so workers x n_jobs never exceeds the cores; other estimators'
+    # n_jobs is left alone (LogisticRegression's lbfgs ignores it and warns when it is set)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    base = clone(mod.build_pipeline().named_steps["clf"])
+    if isinstance(base, BaseEnsemble):
+        base.set_params(n_jobs=threads)
+
+    if method == "grid":
+        rounds = 1
+    else:
+        rounds = max(1, math.ceil(math.log(len(candidates), FACTOR)) + 1)
+    rows = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(str(x_path), str(y_path), threads)) as ex:
+        for r in range(rounds):
+            n_rows = max(min(n, folds * MIN_ROWS_PER_FOLD), n // FACTOR ** (rounds - 1 - r))
+            with span("round", round=r, candidates=len(candidates), rows=n_rows):
+                futures = [
+                    (p, [ex.submit(_fit_fold, clone(base).set_params(**p), n_rows, k, folds) for k in range(folds)])
+                    for p in candidates
+                ]
+                scored = []
+                for p, fs in futures:
+                    aucs, secs = zip(*(f.result() for f in fs))
+                    scored.append((float(np.mean(aucs)), p))
+                    rows.append({"round": r, "n_rows": n_rows, "params": json.dumps(p), **{f"param_{k}": v for k, v in p.items()},
+                                 "mean_auc": float(np.mean(aucs)), "std_auc": float(np.std(aucs)), "fit_seconds": float(np.mean(secs))})
+            print(f"Round {r}: {len(candidates)} candidates x {folds} folds on {n_rows:,} rows; best AUC {max(scored, key=lambda s: s[0])[0]:.4f}")
+            keep = max(1, math.ceil(len(candidates) / FACTOR))
+            candidates = [p for _, p in sorted(scored, key=lambda s: s[0], reverse=True)[:keep]]
+
+    board = pd.DataFrame(rows).sort_values(["round", "mean_auc"], ascending=[False, False], ignore_index=True)
+    board.insert(0, "rank", range(1, len(board) + 1))
+    return board
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("model", choices=list(MODELS))
+    ap.add_argument("--db_path", type=str, default="warehouse.duckdb")
+    ap.add_argument("--out_dir", type=str, default="outputs")
+    ap.add_argument("--search", choices=["halving", "grid"], default="halving")
+    ap.add_argument("--folds", type=int, default=5)
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    x_path, y_path = materialize(args.db_path, args.model)
+    board = search(args.model, x_path, y_path, args.search, args.folds, args.workers)
+    out = Path(args.out_dir) / f"tuning_{args.model}.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    board.to_csv(out, index=False)
+    best = board.iloc[0]
+    print(f"Best {args.model} params {best['params']}: CV ROC-AUC {best['mean_auc']:.4f} +/- {best['std_auc']:.4f} "
+          f"({time.perf_counter() - t0:.1f}s)")
+    print(f"Wrote: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,130 @@
 from __future__ import annotations
 import argparse
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from src.analyses import funnel, ab_test, monitoring
+from src.analyses import funnel, ab_test, monitoring, experiments, active_creators, cube
 from src.modeling import train_propensity, train_churn
+from src.modeling.scoring import default_score_dir, publish_scores
+from src.utils import trace
+from src.utils.db import CursorPool, connect, default_cache_dir, use_result_cache
+from src.utils.sampling import schema_name
+
+# name -> fn(db_path, out_dir, con=...). Tasks are independent: the tables they share (creator_stages,
+# the KPI cube, sketches, samples) are built by the loader, or per connection when missing, and each
+# training task scores with the model it just fit.
+TASKS = {
+    "funnel": funnel.run,
+    "ab_test": ab_test.run,
+    "monitoring": monitoring.run,
+    "experiments": experiments.run,
+    "active_creators": active_creators.run,
+    "cube": cube.run,
+    # Train models (optional but impressive for interviews)
+    "propensity": train_propensity.train,
+    "churn": train_churn.train,
+}
+
+# tasks that write scores partitions (exposed through the creator_scores view)
+SCORING_TASKS = {"propensity", "churn"}
+
+# tasks that can run on a stratified sample (--sample); the others always run exactly
+SAMPLE_TASKS = {"funnel", "ab_test", "monitoring"}
+
+def select_tasks(only: list[str] | None, skip: list[str] | None) -> list[str]:
+    names = list(TASKS)
+    for n in (only or []) + (skip or []):
+        if n not in TASKS:
+            raise SystemExit(f"Unknown task {n!r}; choose from {', '.join(names)}")
+    if only:
+        names = [n for n in names if n in only]
+    return [n for n in names if n not in (skip or [])]
+
+def run_tasks(selected: list[str], db_path: str, out_dir: Path, workers: int = 4, sample: float | None = None) -> dict[str, float]:
+    """Run selected tasks concurrently on one shared read-only pool; a failure does not stop the others.
+
+    With `sample`, SAMPLE_TASKS run on the stratified sample at that rate. Returns per-task wall seconds.
+    """
+    pool = CursorPool(db_path, size=workers)
+    timings: dict[str, float] = {}
+    failed: dict[str, BaseException] = {}
+
+    def _run(name: str) -> float:
+        t0 = time.perf_counter()
+        kwargs = {"sample": sample} if sample and name in SAMPLE_TASKS else {}
+        with pool.cursor() as cur:
+            TASKS[name](db_path, out_dir, con=cur, **kwargs)
+        return time.perf_counter() - t0
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            # each task runs in a copy of this context so its spans nest under the caller's span
+            running = {ex.submit(contextvars.copy_context().run, _run, name): name for name in selected}
+            for fut in as_completed(running):
+                name = running[fut]
+                try:
+                    timings[name] = fut.result()
+                    print(f"[{name}] done in {timings[name]:.2f}s")
+                except Exception as e:
+                    failed[name] = e
+                    print(f"[{name}] FAILED: {e!r}")
+    finally:
+        pool.close()
+
+    if failed:
+        raise SystemExit(f"{len(failed)} task(s) failed: {', '.join(failed)}")
+    return timings
 
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--db_path", type=str, default="warehouse.duckdb")
     p.add_argument("--out_dir", type=str, default="outputs")
+    p.add_argument("--only", nargs="+", default=None)
+    p.add_argument("--skip", nargs="+", default=None)
+    p.add_argument("--workers", type=int, default=4)
+    # serve repeat queries over unchanged tables from <db dir>/query_cache
+    p.add_argument("--cache", action="store_true")
+    p.add_argument("--cache_max_mb", type=int, default=1024)
+    p.add_argument("--trace", type=str, default=None, help="write a span trace (JSON) of the run here")
+    p.add_argument("--profile", action="store_true", help="with --trace, also save DuckDB query profiles")
+    p.add_argument("--trace_top", type=int, default=15, help="slowest spans to list after a traced run")
+    p.add_argument("--sample", type=float, default=None,
+                   help="run funnel/ab_test/monitoring on the stratified sample at this rate (e.g. 0.01), "
+                        "scaled up with 95%% CIs; outputs go to <out_dir>/sample_<rate>pct")
     args = p.parse_args()
+    if args.trace:
+        trace.start(args.trace, profile=args.profile)
+    cache = use_result_cache(default_cache_dir(args.db_path), args.cache_max_mb << 20) if args.cache else None
 
     out_dir = Path(args.out_dir)
+    selected = select_tasks(args.only, args.skip)
+    if args.sample:
+        # approximate outputs never overwrite the exact ones
+        out_dir = out_dir / schema_name(args.sample)
+        exact = [n for n in selected if n not in SAMPLE_TASKS]
+        if exact:
+            print(f"No sample mode for {', '.join(exact)}; running exactly")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    funnel.run(args.db_path, out_dir)
-    ab_test.run(args.db_path, out_dir)
-    monitoring.run(args.db_path, out_dir)
-
-    # Train models (optional but impressive for interviews)
-    train_propensity.main()
-    train_churn.main()
+    t0 = time.perf_counter()
+    try:
+        with trace.span("run_analyses"):
+            run_tasks(selected, args.db_path, out_dir, args.workers, args.sample)
+        if SCORING_TASKS & set(selected):
+            # tasks score on the read-only pool; one writable connection afterwards defines the view
+            con = connect(args.db_path)
+            try:
+                publish_scores(con, default_score_dir(args.db_path))
+            finally:
+                con.close()
+        print(f"All analyses done in {time.perf_counter() - t0:.2f}s")
+        if cache:
+            st = cache.stats()
+            print(f"Query cache: {st['hits']} hits, {st['misses']} misses, {st['evictions']} evictions, "
+                  f"{st['entries']} entries ({st['bytes'] / 1e6:.1f} MB)")
+    finally:
+        trace.finish(args.trace_top)
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,334 @@
 from __future__ import annotations
+import hashlib
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator
 import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
+from src.utils import trace
 
-def connect(db_path: str | Path) -> duckdb.DuckDBPyConnection:
-    return duckdb.connect(str(db_path))
+def connect(db_path: str | Path, read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    return duckdb.connect(str(db_path), read_only=read_only)
 
-def exec_sql(con: duckdb.DuckDBPyConnection, sql: str):
-    return con.execute(sql)
+@contextmanager
+def maybe_connect(db_path: str | Path, con: duckdb.DuckDBPyConnection | None = None) -> Iterator[duckdb.DuckDBPyConnection]:
+    """Use `con` if given (caller owns it), else open a connection to db_path for the block."""
+    if con is not None:
+        yield con
+        return
+    own = connect(db_path)
+    try:
+        yield own
+    finally:
+        own.close()
 
-def read_df(con: duckdb.DuckDBPyConnection, sql: str):
-    return con.execute(sql).df()
+def exec_sql(con: duckdb.DuckDBPyConnection, sql: str, name: str | None = None):
+    """Run a statement (DDL/DML/COPY); fetch query results with read_df/read_batches instead."""
+    label = trace.query_label(sql, name)
+    with trace.span(f"sql {label}") as attrs, trace.profiled(con, label, attrs):
+        return con.execute(sql)
+
+def read_df(con: duckdb.DuckDBPyConnection, sql: str, name: str | None = None):
+    """Run `sql` into a DataFrame; traced as execute + .df() conversion when tracing is on.
+
+    With a result cache installed (use_result_cache), repeat queries over unchanged tables are
+    served from disk.
+    """
+    label = trace.query_label(sql, name)
+    with trace.span(f"sql {label}") as attrs:
+        cache = _result_cache
+        key = cache.key(con, sql) if cache else None
+        if key:
+            df = cache.get(key)
+            if attrs is not None:
+                attrs["cache"] = "miss" if df is None else "hit"
+            if df is not None:
+                return df
+        # the profile must be switched off only after .df(): another execute on con would drop the result
+        with trace.profiled(con, label, attrs):
+            with trace.span("execute"):
+                res = con.execute(sql)
+            with trace.span("to_df") as a:
+                df = res.df()
+                if a is not None:
+                    a["rows"] = len(df)
+        if key:
+            cache.put(key, df)
+        return df
+
+def read_arrow(con: duckdb.DuckDBPyConnection, sql: str, name: str | None = None) -> pa.Table:
+    """Run `sql` into a pyarrow Table (no pandas conversion)."""
+    label = trace.query_label(sql, name)
+    with trace.span(f"sql {label}") as attrs, trace.profiled(con, label, attrs):
+        res = con.execute(sql)
+        return res.to_arrow_table() if hasattr(res, "to_arrow_table") else res.fetch_arrow_table()
+
+EXPORT_FORMATS = {".csv": "FORMAT CSV, HEADER", ".parquet": "FORMAT PARQUET"}
+
+def export(con: duckdb.DuckDBPyConnection, source, path: str | Path, name: str | None = None) -> Path:
+    """Write a query (SQL string) or an in-memory pyarrow Table/DataFrame to CSV or Parquet with DuckDB's COPY.
+
+    The format follows the file suffix. The file is written next to `path` and renamed into place.
+    """
+    path = Path(path)
+    opts = EXPORT_FORMATS.get(path.suffix.lower())
+    if opts is None:
+        raise ValueError(f"Unsupported export format {path.suffix!r}; use one of {sorted(EXPORT_FORMATS)}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    if isinstance(source, str):
+        exec_sql(con, f"COPY ({source.strip().rstrip(';')}) TO '{tmp}' ({opts});", name=name or f"export {path.name}")
+    else:
+        # registered frames/tables are scanned in place, not copied into the database
+        view = f"_export_{threading.get_ident()}"
+        con.register(view, source)
+        try:
+            exec_sql(con, f"COPY {view} TO '{tmp}' ({opts});", name=name or f"export {path.name}")
+        finally:
+            con.unregister(view)
+    os.replace(tmp, path)
+    return path
+
+def read_batches(con: duckdb.DuckDBPyConnection, sql: str, batch_size: int = 100_000):
+    """Stream a query as a pyarrow RecordBatchReader of at most batch_size rows per batch."""
+    res = con.execute(sql)
+    if hasattr(res, "to_arrow_reader"):
+        return res.to_arrow_reader(batch_size)
+    return res.fetch_record_batch(batch_size)
+
+def is_read_only(con: duckdb.DuckDBPyConnection) -> bool:
+    return con.execute("SELECT current_setting('access_mode')").fetchone()[0] == "read_only"
+
+def table_exists(con: duckdb.DuckDBPyConnection, table: str) -> bool:
+    """Whether `table` ("name" in main/temp, or "schema.name") exists."""
+    schema, _, name = table.rpartition(".")
+    return con.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE table_name = ? AND schema_name = ?", [name, schema or "main"]
+    ).fetchone()[0] > 0
+
+def sql_filters(filters: dict[str, str] | None) -> str:
+    """WHERE condition matching each column's text value exactly; column names must be validated by the caller."""
+    return " AND ".join(f"{c}::VARCHAR = '{str(v).replace(chr(39), chr(39) * 2)}'" for c, v in (filters or {}).items()) or "true"
+
+def table_version(con: duckdb.DuckDBPyConnection, table: str) -> str | None:
+    """Version of `table` ("name" in main, or "schema.name") from metadata alone, without scanning it.
+
+    Raw tables: their load_manifest checksums. Derived tables: the signature and time of their last
+    build in derived_builds. None if neither records the table.
+    """
+    if table_exists(con, "load_manifest"):
+        row = con.execute(
+            "SELECT md5(string_agg(checksum, ',' ORDER BY file_path)) FROM load_manifest WHERE table_name = ?", [table]
+        ).fetchone()
+        if row[0] is not None:
+            return row[0]
+    if table_exists(con, "derived_builds"):
+        row = con.execute("SELECT signature || '@' || built_at FROM derived_builds WHERE table_name = ?", [table]).fetchone()
+        if row:
+            return row[0]
+    return None
+
+def table_signature(con: duckdb.DuckDBPyConnection, table: str) -> str:
+    """Content signature of a table: its table_version, or a row-hash scan if it has none."""
+    version = table_version(con, table)
+    if version is not None:
+        return version
+    n, h = con.execute(f"SELECT count(*), sum(hash(t)) FROM {table} t").fetchone()
+    return f"{n}:{h}"
+
+DERIVED_BUILDS_DDL = r"""
+CREATE TABLE IF NOT EXISTS derived_builds (
+  table_name VARCHAR,
+  signature VARCHAR,
+  built_at TIMESTAMP
+);
+"""
+
+def stale_days(con: duckdb.DuckDBPyConnection, table: str, sources: list[str], signature: str) -> list | None:
+    """Days of `sources` (re)loaded or removed since `table` was last built with `signature`, per
+    load_manifest and load_removals.
+
+    None means rebuild everything: first build, changed signature, or a source file without a ds
+    partition (a CSV reload) was loaded or removed since.
+    """
+    con.execute(DERIVED_BUILDS_DDL)
+    last = con.execute("SELECT signature, built_at FROM derived_builds WHERE table_name = ?", [table]).fetchone()
+    if not last or last[0] != signature or not table_exists(con, table) or not table_exists(con, "load_manifest"):
+        return None
+    in_sources = f"table_name IN ({', '.join('?' for _ in sources)})"
+    removals = (f" UNION SELECT partition_ds FROM load_removals WHERE {in_sources} AND removed_at > ?"
+                if table_exists(con, "load_removals") else "")
+    changed = con.execute(
+        f"SELECT DISTINCT partition_ds FROM load_manifest WHERE {in_sources} AND loaded_at > ?{removals}",
+        [*sources, last[1]] * (2 if removals else 1),
+    ).fetchall()
+    if any(r[0] is None for r in changed):
+        return None
+    return sorted(r[0] for r in changed)
+
+def record_build(con: duckdb.DuckDBPyConnection, table: str, signature: str) -> None:
+    con.execute("DELETE FROM derived_builds WHERE table_name = ?", [table])
+    con.execute("INSERT INTO derived_builds VALUES (?, ?, now()::TIMESTAMP)", [table, signature])
+
+class CursorPool:
+    """Fixed set of cursors on one read-only database handle, shared by concurrent tasks."""
+
+    def __init__(self, db_path: str | Path, size: int = 4):
+        self.con = connect(db_path, read_only=True)
+        self._free: queue.Queue = queue.Queue()
+        for _ in range(size):
+            self._free.put(self.con.cursor())
+
+    @contextmanager
+    def cursor(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        cur = self._free.get()
+        try:
+            yield cur
+        finally:
+            self._free.put(cur)
+
+    def close(self) -> None:
+        while not self._free.empty():
+            self._free.get_nowait().close()
+        self.con.close()
+
+def plan_tables(con: duckdb.DuckDBPyConnection, sql: str) -> list[str]:
+    """Tables a query scans (views resolved), from its physical plan, as catalog.schema.name; table
+    function scans (read_parquet behind a view, ...) are listed as "FUNCTION()"."""
+    plan = json.loads(con.execute(f"EXPLAIN (FORMAT json) {sql}").fetchall()[0][1])
+    found = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            info = node.get("extra_info") if isinstance(node.get("extra_info"), dict) else {}
+            if info.get("Table"):
+                found.add(info["Table"])
+            elif info.get("Function"):
+                found.add(f"{info['Function']}()")
+            for child in node.get("children", []):
+                walk(child)
+        elif isinstance(node, list):
+            for n in node:
+                walk(n)
+
+    walk(plan)
+    return sorted(found)
+
+def versioned_name(plan_table: str) -> str | None:
+    """A plan_tables name as load_manifest/derived_builds record it ("name" in main, else "schema.name");
+    None for temp tables, which are private to one connection, and table functions, which have no version."""
+    if plan_table.endswith("()"):
+        return None
+    catalog, schema, name = [p.strip('"') for p in plan_table.split(".")]
+    if catalog == "temp":
+        return None
+    return name if schema == "main" else f"{schema}.{name}"
+
+class ResultCache:
+    """Query results as Parquet files under cache_dir, keyed by the SQL text + version of every table read.
+
+    Table versions come from table_version (manifest checksums or derived build records, never a
+    scan), so a reload or rebuild that changes a table changes the key and old entries simply stop
+    being hit; they age out through LRU eviction (file mtime is the access time) once the directory
+    exceeds max_bytes. Queries that read no tables, or any table without a recorded version (temp
+    tables, tables built outside the loader), are not cached.
+    """
+
+    def __init__(self, cache_dir: str | Path, max_bytes: int = 1 << 30):
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.bypassed = self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, con: duckdb.DuckDBPyConnection, sql: str) -> str | None:
+        # hashed as written: collapsing whitespace would merge queries that differ inside a string
+        # literal or across the end of a -- comment
+        text = sql.strip().rstrip(";")
+        try:
+            tables = plan_tables(con, text)
+        except duckdb.Error:
+            tables = []
+        if not tables:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        h = hashlib.sha256(text.encode())
+        for t in tables:
+            name = versioned_name(t)
+            version = table_version(con, name) if name else None
+            if version is None:
+                with self._lock:
+                    self.bypassed += 1
+                return None
+            h.update(f"\n{name}={version}".encode())
+        return h.hexdigest()[:32]
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        path = self.dir / f"{key}.parquet"
+        try:
+            df = pq.read_table(path).to_pandas()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        path = self.dir / f"{key}.parquet"
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+        except (pa.ArrowException, TypeError, ValueError):
+            tmp.unlink(missing_ok=True)
+            return
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for f in self.dir.glob("*.parquet"):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, f))
+        total = sum(e[1] for e in entries)
+        for _, size, f in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        files = list(self.dir.glob("*.parquet"))
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "entries": len(files),
+            "bytes": sum(f.stat().st_size for f in files),
+        }
+
+_result_cache: ResultCache | None = None
+
+def default_cache_dir(db_path: str | Path) -> Path:
+    return Path(db_path).resolve().parent / "query_cache"
+
+def use_result_cache(cache_dir: str | Path | None, max_bytes: int = 1 << 30) -> ResultCache | None:
+    """Install (or, with None, remove) the process-wide result cache used by read_df."""
+    global _result_cache
+    _result_cache = ResultCache(cache_dir, max_bytes) if cache_dir else None
+    return _result_cache
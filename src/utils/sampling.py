@@ -0,0 +1,104 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from scipy import stats
+from src.utils.db import table_exists
+
+# Persistent creator-keyed stratified samples (built by src.build_samples after each load).
+# Each rate gets its own schema, e.g. sample_1pct, holding the raw tables and creator_stages
+# restricted to the sampled creators, plus per-stratum population/sample counts.
+STRATA = ["tier", "country", "experiment_group"]
+RATES = [0.01, 0.1]
+MEMBERS_TABLE = "sample_creators"
+STRATA_TABLE = "sample_strata"
+
+def schema_name(rate: float) -> str:
+    if not 0 < rate <= 1:
+        raise ValueError(f"Sample rate must be in (0, 1], got {rate}")
+    return "sample_" + f"{rate * 100:g}".replace(".", "_") + "pct"
+
+def require(con, rate: float) -> str:
+    """Schema of the persisted sample at `rate`; raises if it was never built."""
+    schema = schema_name(rate)
+    if not table_exists(con, f"{schema}.{STRATA_TABLE}"):
+        raise ValueError(f"No {rate:.0%} sample in the warehouse; build it with python -m src.build_samples --rates {rate}")
+    return schema
+
+def strata(con, schema: str) -> pd.DataFrame:
+    """Per stratum: population size n_pop and sample size n_sample."""
+    return con.execute(f"SELECT {', '.join(f'{c}::VARCHAR AS {c}' for c in STRATA)}, n_pop, n_sample FROM {schema}.{STRATA_TABLE}").df()
+
+def _grouped(d: pd.DataFrame, by: list[str], cols: list[str]) -> pd.DataFrame:
+    if by:
+        return d.groupby(by, dropna=False, sort=True)[cols].sum().reset_index()
+    return d[cols].sum().to_frame().T
+
+def estimate(df: pd.DataFrame, strata_df: pd.DataFrame, by: list[str], totals: dict[str, tuple] | None = None,
+             ratios: dict[str, tuple] | None = None, fpc: bool = True, digits: dict[str, int] | None = None,
+             alpha: float = 0.05, se: bool = False) -> pd.DataFrame:
+    """Stratified estimates per `by` group, each with a (1 - alpha) normal CI.
+
+    `df` holds sample sums per (by..., stratum) or finer. totals = {name: (y, y_sq)} estimates the
+    population total of y; ratios = {name: (y, x, y_sq, x_sq, yx)} estimates sum(y) / sum(x). Square
+    and product columns may be None for 0/1 indicators (y^2 = y; y implies x). Sampled creators
+    missing from a (group, stratum) row count as zeros. The variance is the stratified-SRS one,
+    N_h^2 (1 - n_h/N_h) s_h^2 / n_h summed over strata, with ratios linearized (z = y - R x);
+    `fpc=False` drops the finite population correction (superpopulation inference, e.g. A/B effects).
+    Returns by... plus <name>, <name>_ci95_low, <name>_ci95_high (and <name>_se with `se`) per
+    estimate, rounded per `digits`.
+    """
+    totals, ratios, digits = totals or {}, ratios or {}, digits or {}
+    specs = [(k, y, None, ysq or y, None, None) for k, (y, ysq) in totals.items()]
+    specs += [(k, y, x, ysq or y, xsq or x, yx or y) for k, (y, x, ysq, xsq, yx) in ratios.items()]
+    cols = list(dict.fromkeys(c for sp in specs for c in sp[1:] if c))
+    d = _grouped(df, list(dict.fromkeys([*by, *STRATA])), cols).merge(strata_df, on=STRATA, how="inner")
+    N, n = d["n_pop"].to_numpy(float), d["n_sample"].to_numpy(float)
+    w = N ** 2 * (1 - (n / N if fpc else 0.0)) / n / np.maximum(n - 1, 1)
+    z = float(stats.norm.ppf(1 - alpha / 2))
+    keys = d.groupby(by, dropna=False, sort=True).ngroup().to_numpy() if by else np.zeros(len(d), dtype=int)
+    n_groups = keys.max() + 1 if len(keys) else 0
+
+    def per_group(v: np.ndarray) -> np.ndarray:
+        return np.bincount(keys, weights=v, minlength=n_groups)
+
+    def var_terms(s: np.ndarray, ss: np.ndarray) -> np.ndarray:
+        # N_h^2 (1 - f_h) / n_h * s_h^2, s_h^2 from the stratum's sum and sum of squares
+        return per_group(w * (ss - s ** 2 / n))
+
+    out = d.groupby(by, dropna=False, sort=True).size().reset_index()[by] if by else pd.DataFrame(index=[0])
+    for name, y, x, ysq, xsq, yx in specs:
+        sy, ssy = d[y].to_numpy(float), d[ysq].to_numpy(float)
+        ty = per_group(N * sy / n)
+        if x is None:
+            est, var = ty, var_terms(sy, ssy)
+        else:
+            sx, ssx, sxy = d[x].to_numpy(float), d[xsq].to_numpy(float), d[yx].to_numpy(float)
+            tx = per_group(N * sx / n)
+            est = np.divide(ty, tx, out=np.full_like(ty, np.nan), where=tx > 0)
+            r = np.nan_to_num(est)[keys]
+            var = var_terms(sy - r * sx, ssy - 2 * r * sxy + r ** 2 * ssx) / np.where(tx > 0, tx, np.nan) ** 2
+        sd = np.sqrt(np.clip(var, 0, None))
+        half = z * sd
+        lo, hi = est - half, est + half
+        if (df[[c for c in (y, x, ysq, xsq, yx) if c]] >= 0).all().all():
+            # a total or ratio of non-negative measures cannot be negative
+            lo = np.clip(lo, 0, None)
+        out[name], out[f"{name}_ci95_low"], out[f"{name}_ci95_high"] = est, lo, hi
+        if name in digits:
+            cols_ = [name, f"{name}_ci95_low", f"{name}_ci95_high"]
+            out[cols_] = out[cols_].round(digits[name])
+            if digits[name] == 0:
+                out[cols_] = out[cols_].astype("int64")
+        if se:
+            out[f"{name}_se"] = sd
+    return out
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, qs: list[float]) -> list[float]:
+    order = np.argsort(values)
+    v = np.asarray(values, dtype=float)[order]
+    w = np.asarray(weights, dtype=float)[order]
+    cw = np.cumsum(w) - w
+    # positions (cumulative weight before each value) / (total - last weight): with equal weights
+    # this is i / (n - 1), i.e. DuckDB's quantile_cont
+    pos = cw / cw[-1] if len(v) > 1 and cw[-1] > 0 else np.zeros(len(v))
+    return [float(np.interp(q, pos, v)) for q in qs]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy import stats
 
@@ -17,14 +18,168 @@ def diff_in_proportions(p1: float, n1: int, p2: float, n2: int, alpha: float = 0
     lo, hi = diff - z*se, diff + z*se
     return diff, (float(lo), float(hi))
 
-def bootstrap_ci(values: np.ndarray, stat_fn=np.mean, n_boot: int = 2000, alpha: float = 0.05, seed: int = 7):
-    rng = np.random.default_rng(seed)
-    values = np.asarray(values)
-    boots = []
-    for _ in range(n_boot):
-        sample = rng.choice(values, size=len(values), replace=True)
-        boots.append(stat_fn(sample))
-    boots = np.sort(np.asarray(boots))
+# named statistics the bootstrap engine evaluates as matrix ops over blocks of resamples
+_STAT_ALIASES = {np.mean: "mean", np.sum: "sum", np.median: "median"}
+
+def _units(values, denom, clusters):
+    """Collapse rows to resampling units: per-unit numerator and denominator sums.
+
+    Without clusters every row is a unit (den = denom or 1). With clusters, rows are summed per cluster,
+    so mean / ratio-of-sums over resampled clusters is exact.
+    """
+    num = np.asarray(values, dtype=float)
+    den = None if denom is None else np.asarray(denom, dtype=float)
+    if clusters is None:
+        return num, den, None
+    den = np.ones_like(num) if den is None else den
+    keys, inv = np.unique(np.asarray(clusters), return_inverse=True)
+    return np.bincount(inv, weights=num, minlength=len(keys)), np.bincount(inv, weights=den, minlength=len(keys)), inv
+
+def _strata_layout(strata, n_units):
+    """Unit order grouped by stratum (None = natural order), plus (start, size) per stratum."""
+    if strata is None:
+        return None, [(0, n_units)]
+    codes = np.unique(np.asarray(strata), return_inverse=True)[1]
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return order, list(zip(starts.tolist(), sizes.tolist()))
+
+def _resample_block(rng, b, layout, method):
+    """(b, n_units) resample matrix over units in layout order: indices ('index') or Poisson(1) weights ('poisson')."""
+    order, strata = layout
+    n_units = sum(size for _, size in strata)
+    if method == "poisson":
+        return rng.poisson(1.0, size=(b, n_units)).astype(np.float32)
+    if order is None:
+        return rng.integers(0, n_units, size=(b, n_units))
+    idx = np.empty((b, n_units), dtype=np.int64)
+    for start, size in strata:
+        idx[:, start:start + size] = rng.integers(start, start + size, size=(b, size))
+    return idx
+
+def _eval_block(res, method, num, den, stat, q, stat_fn):
+    # den is None for plain row-level statistics: every unit counts once
+    if method == "poisson":
+        if stat in ("mean", "ratio"):
+            return (res @ num) / (res.sum(axis=1) if den is None else res @ den)
+        if stat == "sum":
+            return res @ num
+        raise ValueError(f"stat={stat!r} needs method='index'")
+    if stat in ("mean", "ratio"):
+        return num[res].sum(axis=1) / (res.shape[1] if den is None else den[res].sum(axis=1))
+    if stat == "sum":
+        return num[res].sum(axis=1)
+    if stat in ("median", "quantile"):
+        return np.quantile(num[res], 0.5 if stat == "median" else q, axis=1)
+    return np.apply_along_axis(stat_fn, 1, num[res])
+
+def bootstrap_dist(
+    values: np.ndarray,
+    stat="mean",
+    denom: np.ndarray | None = None,
+    q: float = 0.5,
+    strata: np.ndarray | None = None,
+    clusters: np.ndarray | None = None,
+    n_boot: int = 2000,
+    method: str = "index",
+    seed: int = 7,
+    workers: int = 1,
+    max_block_bytes: int = 8 << 20,
+) -> np.ndarray:
+    """Bootstrap distribution of a statistic, computed in memory-bounded blocks of resamples.
+
+    stat: "mean", "sum", "ratio" (sum(values)/sum(denom)), "median", "quantile" (at q), or a callable
+    applied per resample row. strata resample within groups (sizes kept); clusters resample whole
+    clusters (e.g. creator_id) — only mean/sum/ratio. method="poisson" uses Poisson(1) weights instead
+    of indices (mean/sum/ratio only). Block b always uses SeedSequence(seed).spawn(...)[b], so the
+    result is identical for any `workers`.
+    """
+    stat_fn = stat if callable(stat) else None
+    stat = _STAT_ALIASES.get(stat, stat) if callable(stat) else stat
+    if stat == "ratio" and denom is None:
+        raise ValueError("stat='ratio' requires denom")
+    if clusters is not None and stat not in ("mean", "sum", "ratio"):
+        raise ValueError("clustered bootstrap supports mean, sum and ratio only")
+    if method not in ("index", "poisson"):
+        raise ValueError("method must be 'index' or 'poisson'")
+
+    num, den, inv = _units(values, denom, clusters)
+    if strata is not None and inv is not None:
+        # a cluster's stratum is that of its first row
+        first_row = np.unique(inv, return_index=True)[1]
+        strata = np.asarray(strata)[first_row]
+    layout = _strata_layout(strata, len(num))
+    if layout[0] is not None:
+        num = num[layout[0]]
+        den = None if den is None else den[layout[0]]
+
+    # small blocks keep the resample matrix and its gathered values cache-resident
+    block = max(1, min(n_boot, max_block_bytes // (8 * max(len(num), 1))))
+    sizes = [min(block, n_boot - i) for i in range(0, n_boot, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    def _run(i):
+        res = _resample_block(np.random.default_rng(seeds[i]), sizes[i], layout, method)
+        return _eval_block(res, method, num, den, stat, q, stat_fn)
+
+    if workers > 1 and len(sizes) > 1:
+        # numpy releases the GIL in the heavy kernels, so threads avoid copying data to processes
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(_run, range(len(sizes))))
+    else:
+        parts = [_run(i) for i in range(len(sizes))]
+    return np.concatenate(parts)
+
+def bootstrap_ci(values: np.ndarray, stat_fn=np.mean, n_boot: int = 2000, alpha: float = 0.05, seed: int = 7, **kwargs):
+    boots = bootstrap_dist(values, stat=stat_fn, n_boot=n_boot, seed=seed, **kwargs)
     lo = np.quantile(boots, alpha/2)
     hi = np.quantile(boots, 1-alpha/2)
     return float(lo), float(hi)
+
+# --- tests from per-group sufficient statistics (n, sums, sums of squares / cross-products) ---
+
+def mean_var_from_sums(n, s, ss):
+    n = np.asarray(n, dtype=float)
+    mean = s / n
+    var = (ss - s*s/n) / np.maximum(n - 1, 1)
+    return mean, var
+
+def cov_from_sums(n, sx, sy, sxy):
+    n = np.asarray(n, dtype=float)
+    return (sxy - sx*sy/n) / np.maximum(n - 1, 1)
+
+def ratio_from_sums(n, sy, syy, sd, sdd, syd):
+    # ratio of sums sum(y)/sum(d) and its delta-method variance
+    n = np.asarray(n, dtype=float)
+    r = sy / sd
+    _, vy = mean_var_from_sums(n, sy, syy)
+    _, vd = mean_var_from_sums(n, sd, sdd)
+    c = cov_from_sums(n, sy, sd, syd)
+    md = sd / n
+    var_r = (vy - 2*r*c + r*r*vd) / (n * md*md)
+    return r, var_r
+
+def diff_test(m1, se1_sq, m2, se2_sq, alpha: float = 0.05):
+    # difference m2 - m1 with normal-approx CI and two-sided p-value, given squared standard errors
+    diff = m2 - m1
+    se = math.sqrt(se1_sq + se2_sq)
+    z = stats.norm.ppf(1 - alpha/2)
+    p = float(2 * stats.norm.sf(abs(diff) / se)) if se > 0 else float("nan")
+    return float(diff), float(se), (float(diff - z*se), float(diff + z*se)), p
+
+def cuped_theta(n, sx, sxx, sy, sxy):
+    # pooled regression slope of y on pre-period covariate x
+    _, vx = mean_var_from_sums(n, sx, sxx)
+    return float(cov_from_sums(n, sx, sy, sxy) / vx) if vx > 0 else 0.0
+
+def binned_auc(pos_hist: np.ndarray, neg_hist: np.ndarray) -> float:
+    # ROC-AUC from per-score-bin counts of positives/negatives (ties within a bin count half);
+    # exact up to the bin width, so scores can be accumulated without keeping them
+    pos = np.asarray(pos_hist, dtype=float)
+    neg = np.asarray(neg_hist, dtype=float)
+    n_pos, n_neg = pos.sum(), neg.sum()
+    if not n_pos or not n_neg:
+        return float("nan")
+    neg_below = np.cumsum(neg) - neg
+    return float((pos * (neg_below + 0.5 * neg)).sum() / (n_pos * n_neg))
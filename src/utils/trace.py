@@ -0,0 +1,159 @@
+from __future__ import annotations
+import functools
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator
+
+# Nested timed spans for one run. Off by default: span() is a no-op until start() is called.
+# The trace is written in Chrome trace-event format (open in chrome://tracing or ui.perfetto.dev).
+
+class _Run:
+    def __init__(self, path: Path, profile_dir: Path | None):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.t0 = time.perf_counter()
+        self.spans: list[dict] = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+_run: _Run | None = None
+_parent: ContextVar[dict | None] = ContextVar("trace_parent", default=None)
+
+def start(path: str | Path, profile: bool = False) -> None:
+    """Begin recording spans to `path`; with `profile`, also save DuckDB JSON profiles of named queries."""
+    global _run
+    path = Path(path)
+    profile_dir = path.with_name(f"{path.stem}_profiles") if profile else None
+    if profile_dir:
+        profile_dir.mkdir(parents=True, exist_ok=True)
+    _run = _Run(path, profile_dir)
+
+def enabled() -> bool:
+    return _run is not None
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[dict | None]:
+    """Time the block as a child of the enclosing span; yields the span's attrs dict (None when off)."""
+    run = _run
+    if run is None:
+        yield None
+        return
+    parent = _parent.get()
+    rec = {
+        "id": next(run.ids),
+        "parent": parent["id"] if parent else None,
+        "name": name,
+        "thread": threading.current_thread().name,
+        "attrs": attrs,
+    }
+    token = _parent.set(rec)
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = repr(e)
+        raise
+    finally:
+        rec["start"] = t0 - run.t0
+        rec["seconds"] = time.perf_counter() - t0
+        _parent.reset(token)
+        with run.lock:
+            run.spans.append(rec)
+
+def traced(name: str):
+    """Decorator form of span()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def query_label(sql: str, name: str | None = None) -> str:
+    return name or re.sub(r"\s+", " ", sql).strip()[:60]
+
+def profile_path(label: str) -> Path | None:
+    """Where to write the DuckDB profile of a named query, or None if profiling is off."""
+    run = _run
+    if run is None or run.profile_dir is None:
+        return None
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", label)[:60]
+    return run.profile_dir / f"{next(run.ids):05d}-{slug}.json"
+
+@contextmanager
+def profiled(con, label: str, attrs: dict | None) -> Iterator[None]:
+    """Capture a DuckDB JSON profile of the queries run on `con` inside the block (if profiling is on).
+
+    Profiling settings are per connection/cursor, so concurrent cursors do not interfere.
+    """
+    out = profile_path(label)
+    if out is None:
+        yield
+        return
+    con.execute("SET enable_profiling='json'")
+    con.execute(f"SET profiling_output='{out}'")
+    try:
+        yield
+    finally:
+        con.execute("PRAGMA disable_profiling")
+        if attrs is not None and out.exists():
+            prof = json.loads(out.read_text(encoding="utf-8"))
+            attrs["profile"] = out.name
+            for k in ("latency", "cpu_time", "rows_returned", "cumulative_cardinality", "cumulative_rows_scanned"):
+                if k in prof:
+                    attrs[k] = prof[k]
+
+def summary(top_n: int = 15, run: _Run | None = None) -> str:
+    """Top-N slowest spans plus per-name totals, as a text table."""
+    run = run or _run
+    if run is None:
+        return ""
+    spans = sorted(run.spans, key=lambda s: s["seconds"], reverse=True)
+    lines = [f"Top {min(top_n, len(spans))} slowest spans:", f"  {'seconds':>9}  {'self':>9}  span"]
+    child_time: dict[int, float] = {}
+    for s in run.spans:
+        if s["parent"] is not None:
+            child_time[s["parent"]] = child_time.get(s["parent"], 0.0) + s["seconds"]
+    for s in spans[:top_n]:
+        self_s = max(s["seconds"] - child_time.get(s["id"], 0.0), 0.0)
+        lines.append(f"  {s['seconds']:>9.3f}  {self_s:>9.3f}  {s['name']}")
+
+    totals: dict[str, list[float]] = {}
+    for s in run.spans:
+        totals.setdefault(s["name"], []).append(s["seconds"])
+    lines += ["By name (total):", f"  {'total':>9}  {'count':>6}  {'max':>9}  span"]
+    for name, secs in sorted(totals.items(), key=lambda kv: sum(kv[1]), reverse=True)[:top_n]:
+        lines.append(f"  {sum(secs):>9.3f}  {len(secs):>6}  {max(secs):>9.3f}  {name}")
+    return "\n".join(lines)
+
+def finish(top_n: int = 15) -> Path | None:
+    """Write the trace file, print the slowest-span summary and stop recording."""
+    global _run
+    run = _run
+    if run is None:
+        return None
+    _run = None
+    threads: dict[str, int] = {}
+    events = []
+    for s in sorted(run.spans, key=lambda s: s["start"]):
+        tid = threads.setdefault(s["thread"], len(threads))
+        events.append({
+            "name": s["name"], "ph": "X", "pid": os.getpid(), "tid": tid,
+            "ts": round(s["start"] * 1e6), "dur": round(s["seconds"] * 1e6),
+            "args": {"id": s["id"], "parent": s["parent"], **s["attrs"]},
+        })
+    events += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": t}}
+               for t, tid in threads.items()]
+    run.path.parent.mkdir(parents=True, exist_ok=True)
+    run.path.write_text(json.dumps({"traceEvents": events}, default=str), encoding="utf-8")
+    print(summary(top_n, run))
+    print(f"Wrote trace: {run.path}" + (f" (query profiles in {run.profile_dir})" if run.profile_dir else ""))
+    return run.path
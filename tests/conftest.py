@@ -0,0 +1,30 @@
+from __future__ import annotations
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from src import load_duckdb
+from src.utils.db import connect
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def generate(out_dir: Path, n_creators: int = 300, days: int = 6, seed: int = 7, stream: bool = True) -> Path:
+    """Synthetic source files from src/generate_data.py (day-partitioned Parquet with `stream`)."""
+    cmd = [sys.executable, "src/generate_data.py", "--out_dir", str(out_dir), "--n_creators", str(n_creators),
+           "--days", str(days), "--seed", str(seed), *(["--stream"] if stream else [])]
+    subprocess.run(cmd, cwd=ROOT, check=True, capture_output=True)
+    return out_dir
+
+def load(db_path: Path, data_dir: Path, incremental: bool = False):
+    """Load `data_dir` into `db_path` and refresh the derived tables, as src.load_duckdb does."""
+    con = connect(db_path)
+    load_duckdb.load_all(con, data_dir, incremental=incremental)
+    load_duckdb.refresh_derived(con)
+    return con
+
+@pytest.fixture(scope="session")
+def warehouse(tmp_path_factory) -> Path:
+    """A small loaded warehouse shared by read-only tests."""
+    root = tmp_path_factory.mktemp("warehouse")
+    load(root / "w.duckdb", generate(root / "data")).close()
+    return root / "w.duckdb"
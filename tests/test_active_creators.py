@@ -0,0 +1,60 @@
+from __future__ import annotations
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from src.analyses import active_creators as ac
+from src.utils.db import connect
+
+SEGMENTS = [(), ("tier",), ("category",)]
+WINDOWS = [1, 3]
+
+def merged_hll(sketch: pd.DataFrame, seg: tuple[str, ...], window: int) -> pd.DataFrame:
+    """HLL estimates from re-merging every register over each day's whole window."""
+    m, am2 = ac.M, 0.7213 / (1 + 1.079 / ac.M) * ac.M * ac.M
+    days = pd.date_range(sketch["ds"].min(), sketch["ds"].max())
+    groups = sketch.groupby(list(seg), dropna=False) if seg else [((), sketch)]
+    rows = []
+    for key, g in groups:
+        for day in days:
+            regs = g[(g["ds"] > day - pd.Timedelta(days=window)) & (g["ds"] <= day)].groupby("reg")["rho"].max()
+            zeros = m - len(regs)
+            s = zeros + np.exp2(-regs.to_numpy(float)).sum()
+            if regs.empty:
+                n = 0
+            elif am2 / s <= 2.5 * m and zeros > 0:
+                n = round(m * math.log(m / zeros))
+            else:
+                n = round(am2 / s)
+            rows.append({"ds": day, **dict(zip(seg, key if isinstance(key, tuple) else (key,))), "active_creators": n})
+    return pd.DataFrame(rows)
+
+@pytest.fixture(scope="module")
+def con(warehouse):
+    con = connect(warehouse, read_only=True)
+    yield con
+    con.close()
+
+@pytest.mark.parametrize("seg", SEGMENTS)
+def test_rolling_deltas_match_merging_the_window(con, seg):
+    sketch = con.execute(f"SELECT ds, tier::VARCHAR AS tier, category::VARCHAR AS category, reg, rho FROM {ac.SKETCH_TABLE}").df()
+    sketch["ds"] = pd.to_datetime(sketch["ds"])
+    for w in WINDOWS:
+        got = con.execute(ac.rolling_hll_sql(seg, w)).df()
+        got["ds"] = pd.to_datetime(got["ds"])
+        got[list(seg)] = got[list(seg)].astype(object).astype(str)
+        want = merged_hll(sketch, seg, w)
+        want[list(seg)] = want[list(seg)].astype(object).astype(str)
+        merged = got.merge(want, on=["ds", *seg], how="outer", suffixes=("", "_merged"), validate="1:1")
+        assert len(merged) == len(got) == len(want)
+        np.testing.assert_allclose(merged["active_creators"], merged["active_creators_merged"], atol=1)
+
+def test_hll_is_close_to_exact(con):
+    hll = ac.rolling_active(con, WINDOWS, SEGMENTS)
+    exact = ac.rolling_active(con, WINDOWS, SEGMENTS, exact=True)
+    keys = ["ds", "grouping_set", "window_days", *ac.SEGMENT_COLUMNS]
+    # both modes return the same rows, empty windows included
+    pd.testing.assert_frame_equal(hll[keys], exact[keys])
+    assert (exact["active_creators"] == 0).any()
+    err = (hll["active_creators"] - exact["active_creators"]).abs() / exact["active_creators"].clip(lower=1)
+    assert err.max() < 4 * ac.STD_ERROR
@@ -0,0 +1,154 @@
+from __future__ import annotations
+import asyncio
+import json
+import shutil
+import threading
+import time
+import duckdb
+from src import kpi_service
+from src.kpi_service import ENDPOINTS, KpiService, render
+from src.modeling.scoring import default_score_dir
+from src.utils.db import connect
+from tests.conftest import generate, load
+
+async def get(port: int, target: str, headers: dict[str, str] | None = None) -> tuple[int, dict[str, str], bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        extra = "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: 127.0.0.1\r\n{extra}Connection: close\r\n\r\n".encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        head = {}
+        while (line := await reader.readline()).strip():
+            k, _, v = line.decode("latin-1").partition(":")
+            head[k.strip().lower()] = v.strip()
+        return status, head, await reader.readexactly(int(head["content-length"]))
+    finally:
+        writer.close()
+
+def expected(db_path, path: str, params: dict[str, str], fmt: str = "json") -> bytes:
+    """The endpoint's body computed on a connection of our own."""
+    con = connect(db_path, read_only=True)
+    try:
+        return render(ENDPOINTS[path][0](con, str(db_path), params), fmt)
+    finally:
+        con.close()
+
+def write_scores(db_path, run_date: str) -> None:
+    con = duckdb.connect()
+    ids = con.execute(f"SELECT creator_id FROM read_parquet('{db_path.parent / 'data' / 'creators' / '*.parquet'}')").df()
+    part = default_score_dir(db_path) / "model=propensity" / f"run_date={run_date}"
+    part.mkdir(parents=True)
+    ids.assign(score=(ids["creator_id"] * 7919 % 1000) / 1000).to_parquet(part / "part-0.parquet", index=False)
+
+class Probe(KpiService):
+    """Counts queries that reached the cache/in-flight checks."""
+    arrived = 0
+
+    async def query(self, *args, **kwargs):
+        self.arrived += 1
+        return await super().query(*args, **kwargs)
+
+async def wait_for(cond, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+def test_service_on_localhost(warehouse, tmp_path, monkeypatch):
+    db = tmp_path / "w.duckdb"
+    shutil.copy(warehouse, db)
+    shutil.copytree(warehouse.parent / "data", tmp_path / "data")
+    write_scores(db, "2026-01-01")
+    service = Probe(str(db), workers=2, release_after=0.2)
+
+    async def scenario():
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            # every endpoint answers with what its function returns
+            for target, path, params in [
+                ("/monitoring?by=tier&tier=Small", "/monitoring", {"by": "tier", "tier": "Small"}),
+                ("/funnel", "/funnel", {}),
+                ("/funnel?by=country&experiment_group=treatment", "/funnel", {"by": "country", "experiment_group": "treatment"}),
+                ("/experiments", "/experiments", {}),
+                ("/top_creators?k=5&tier=Large", "/top_creators", {"k": "5", "tier": "Large"}),
+            ]:
+                status, head, body = await get(port, target)
+                assert status == 200, (target, body)
+                assert head["content-type"] == "application/json" and head["x-cache"] == "miss"
+                payload = json.loads(body)
+                assert payload["rows"], target
+                assert body == expected(db, path, params), target
+            status, head, body = await get(port, "/funnel?format=csv")
+            assert status == 200 and head["content-type"].startswith("text/csv")
+            assert body == expected(db, "/funnel", {}, "csv")
+            status, _, body = await get(port, "/health")
+            assert status == 200 and json.loads(body)["pool_open"]
+
+            # validation
+            for target in ["/funnel?bogus=1", "/funnel?format=xml", "/funnel?tier=Small&tier=Mid",
+                           "/funnel?by=bogus", "/monitoring?start=yesterday", "/top_creators?k=0", "/top_creators?model=x"]:
+                status, _, body = await get(port, target)
+                assert status == 400 and json.loads(body)["error"], target
+            for target in ["/nope", "/top_creators?model=churn"]:
+                status, _, body = await get(port, target)
+                assert status == 404 and json.loads(body)["error"], target
+
+            # ETag: a repeat with If-None-Match is answered 304 without a body; a plain repeat is a hit
+            status, head, _ = await get(port, "/funnel")
+            assert status == 200 and head["x-cache"] == "hit"
+            etag = head["etag"]
+            status, head, body = await get(port, "/funnel", {"If-None-Match": etag})
+            assert status == 304 and body == b"" and head["etag"] == etag
+            assert service.stats["not_modified"] == 1
+
+            # identical concurrent requests share one query: hold it until every request is waiting on it
+            release = threading.Event()
+            fn, accepted = ENDPOINTS["/monitoring"]
+            monkeypatch.setitem(kpi_service.ENDPOINTS, "/monitoring", (lambda *a: release.wait(10) and fn(*a), accepted))
+            before, n = dict(service.stats), 8
+            service.arrived = 0
+            clients = [asyncio.create_task(get(port, "/monitoring?by=country")) for _ in range(n)]
+            await wait_for(lambda: service.arrived == n)
+            release.set()
+            bodies = {body for status, _, body in await asyncio.gather(*clients) if status == 200}
+            assert len(bodies) == 1
+            assert service.stats["miss"] - before.get("miss", 0) == 1
+            assert service.stats["coalesced"] - before.get("coalesced", 0) == n - 1
+            monkeypatch.setitem(kpi_service.ENDPOINTS, "/monitoring", (fn, accepted))
+
+            # reload: the idle pool is released so the loader can write, then the new data is served
+            reaper = asyncio.create_task(service.release_idle())
+            await wait_for(lambda: service._handle is None)
+            reaper.cancel()
+            old = json.loads((await asyncio.to_thread(lambda: expected(db, "/monitoring", {}))))
+            await asyncio.to_thread(lambda: load(db, generate(tmp_path / "data", n_creators=300, days=6, seed=8)).close())
+            reloads = service.stats["reloads"]
+            # a slow reopen runs off the event loop, once for all the requests waiting on it
+            opens = []
+
+            class SlowHandle(kpi_service._Handle):
+                def __init__(self, *args):
+                    opens.append(1)
+                    time.sleep(0.5)
+                    super().__init__(*args)
+
+            monkeypatch.setattr(kpi_service, "_Handle", SlowHandle)
+            waiting = [asyncio.create_task(get(port, "/monitoring", {"If-None-Match": etag})) for _ in range(4)]
+            await wait_for(lambda: opens)
+            t0 = time.monotonic()
+            status, _, _ = await get(port, "/health")
+            assert status == 200 and time.monotonic() - t0 < 0.25
+            for status, head, body in await asyncio.gather(*waiting):
+                assert status == 200 and head["x-cache"] in ("miss", "coalesced")
+            assert len(opens) == 1
+            assert service.stats["reloads"] == reloads + 1
+            assert body == expected(db, "/monitoring", {}) and json.loads(body) != old
+            status, head, _ = await get(port, "/funnel", {"If-None-Match": etag})
+            assert status == 200 and head["etag"] != etag
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(scenario())
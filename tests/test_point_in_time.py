@@ -0,0 +1,57 @@
+from __future__ import annotations
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from src.modeling import point_in_time
+from src.utils.db import connect
+
+WINDOWS = dict(feature_days=4, recent_days=2, label_days=2)
+
+def brute_force(con, as_of, feature_days: int, recent_days: int, label_days: int) -> pd.DataFrame:
+    """The training set recomputed row by row from the raw tables, one cutoff at a time."""
+    creators = con.execute("SELECT creator_id, created_at, tier::VARCHAR AS tier, country::VARCHAR AS country, "
+                           "experiment_group::VARCHAR AS experiment_group FROM raw_creators").df()
+    episodes = con.execute("SELECT creator_id, published_at::DATE AS ds FROM raw_episodes").df()
+    listens = con.execute("SELECT creator_id, event_date::DATE AS ds, listens FROM raw_listening_events").df()
+    revenue = con.execute("SELECT creator_id, event_date::DATE AS ds, revenue_usd FROM raw_revenue_events").df()
+    events = con.execute("SELECT creator_id, event_name, event_ts FROM raw_creator_events").df()
+    first = {name: g.groupby("creator_id")["event_ts"].min() for name, g in events.groupby("event_name")}
+
+    def window(df, value, start, end):
+        rows = df[(df["ds"] >= start) & (df["ds"] < end)]
+        return rows.groupby("creator_id")[value].sum() if value else rows.groupby("creator_id").size()
+
+    out = []
+    for t in as_of:
+        ts = pd.Timestamp(t)
+        g = creators[creators["created_at"] < ts].drop(columns="created_at").copy()
+        g.insert(0, "as_of", t)
+        ids = g["creator_id"]
+        eligible, enroll = (first.get(e, pd.Series(dtype="datetime64[us]")).reindex(ids) for e in ("eligible", "enroll"))
+        g["eligible"] = (eligible < ts).astype(int).to_numpy()
+        g["enrolled"] = (enroll < ts).astype(int).to_numpy()
+        feat = lambda df, value, days: window(df, value, ts - pd.Timedelta(days=days), ts).reindex(ids).fillna(0).to_numpy()
+        g["episodes_last_30d"] = feat(episodes, None, recent_days)
+        g["episodes_180d"] = feat(episodes, None, feature_days)
+        g["listens_180d"] = feat(listens, "listens", feature_days)
+        g["revenue_180d"] = feat(revenue, "revenue_usd", feature_days)
+        future = window(episodes, None, ts, ts + pd.Timedelta(days=label_days)).reindex(ids).fillna(0).to_numpy()
+        g["label_churn"] = (future == 0).astype(int)
+        g["label_enroll"] = ((enroll >= ts) & (enroll < ts + pd.Timedelta(days=label_days))).astype(int).to_numpy()
+        out.append(g)
+    return pd.concat(out).sort_values(["as_of", "creator_id"]).reset_index(drop=True)
+
+def test_point_in_time_matches_brute_force(warehouse):
+    con = connect(warehouse, read_only=True)
+    lo, hi = point_in_time.data_range(con)
+    as_of = [lo + timedelta(days=1), lo + timedelta(days=3), hi - timedelta(days=WINDOWS["label_days"] - 1)]
+    got = point_in_time.build(con, as_of, **WINDOWS)
+    want = brute_force(con, as_of, **WINDOWS)
+    con.close()
+
+    assert len(got) > 0 and got["label_churn"].nunique() == 2
+    got["as_of"] = pd.to_datetime(got["as_of"]).dt.date
+    for c in got.columns.drop(["as_of", "tier", "country", "experiment_group"]):
+        got[c] = got[c].astype(np.float64)
+        want[c] = want[c].astype(np.float64)
+    pd.testing.assert_frame_equal(got, want[got.columns], check_exact=False, rtol=1e-9)
@@ -0,0 +1,37 @@
+from __future__ import annotations
+import duckdb
+import numpy as np
+import pandas as pd
+from src.modeling import incremental, registry, train_churn
+
+def toy_features(n: int = 400, seed: int = 0) -> tuple[pd.DataFrame, pd.Series]:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({
+        "creator_id": np.arange(n),
+        "tier": rng.choice(["Small", "Mid", "Large"], n),
+        "country": rng.choice(["US", "CA"], n),
+        "experiment_group": rng.choice(["control", "treatment"], n),
+        **{c: rng.poisson(5, n) for c in train_churn.NUM_COLS},
+    })
+    return X, pd.Series(rng.integers(0, 2, n))
+
+def test_holdout_mask_matches_split_sql():
+    con = duckdb.connect()
+    X, _ = toy_features()
+    mask = incremental.holdout_mask(con, X["creator_id"])
+    holdout = con.execute(f"SELECT creator_id FROM ({incremental.split_sql('SELECT * FROM X', test=True)})").df()
+    assert set(X.loc[mask, "creator_id"]) == set(holdout["creator_id"])
+    assert 0.15 < mask.mean() < 0.35
+
+def test_warm_start_requires_same_split():
+    X, y = toy_features()
+    schema = registry.feature_schema(X, train_churn.CAT_COLS, train_churn.NUM_COLS)
+    prev = train_churn.build_pipeline()
+    prev.named_steps["clf"].set_params(n_estimators=5, n_jobs=1)
+    prev.fit(X, y)
+
+    meta = {"schema": schema, "split": incremental.HOLDOUT}
+    assert registry.warm_start_from(train_churn.build_pipeline(), prev, meta, schema, incremental.HOLDOUT)
+    # models saved with another (or an unrecorded, random) split start cold
+    assert not registry.warm_start_from(train_churn.build_pipeline(), prev, {"schema": schema}, schema, incremental.HOLDOUT)
+    assert not registry.warm_start_from(train_churn.build_pipeline(), prev, {**meta, "split": "random"}, schema, incremental.HOLDOUT)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import pandas as pd
+from src.analyses import cube, funnel
+from src.utils.db import ResultCache, read_df, use_result_cache
+from src.utils.sampling import RATES, schema_name
+from tests.conftest import generate, load
+
+SAMPLE = schema_name(RATES[-1])
+QUERIES = [
+    "SELECT count(*) AS n, sum(listens) AS listens FROM raw_listening_events",
+    f"SELECT count(*) AS n, sum(listens) AS listens FROM {SAMPLE}.raw_listening_events",
+    f"SELECT stage_mask, count(*) AS n FROM {funnel.STAGE_TABLE} GROUP BY ALL ORDER BY ALL",
+    f"SELECT count(*) AS n, sum(listens) AS listens FROM {cube.rollup_table(())}",
+    "SELECT tier, count(*) AS n -- a comment must not hide the rest of the query\nFROM raw_creators GROUP BY ALL ORDER BY ALL",
+]
+
+def cached(cache: ResultCache, con, sql: str) -> tuple[pd.DataFrame, bool]:
+    hits = cache.hits
+    return read_df(con, sql), cache.hits > hits
+
+def test_reload_invalidates_cached_results(tmp_path):
+    cache = use_result_cache(tmp_path / "cache")
+    try:
+        data = generate(tmp_path / "data", n_creators=300, days=4, seed=7)
+        con = load(tmp_path / "w.duckdb", data)
+        before = {}
+        for sql in QUERIES:
+            before[sql], hit = cached(cache, con, sql)
+            assert not hit, sql
+            again, hit = cached(cache, con, sql)
+            assert hit, sql
+            pd.testing.assert_frame_equal(again, before[sql], obj=sql)
+        assert cache.bypassed == 0
+
+        # queries that differ only in whitespace inside a literal or after a -- comment are distinct
+        for a, b in [
+            ("SELECT 'a  b' AS s, count(*) AS n FROM raw_creators", "SELECT 'a b' AS s, count(*) AS n FROM raw_creators"),
+            ("SELECT count(*) AS n FROM raw_creators -- note\nWHERE creator_id % 2 = 0",
+             "SELECT count(*) AS n FROM raw_creators -- note WHERE creator_id % 2 = 0"),
+        ]:
+            ka, kb = cache.key(con, a), cache.key(con, b)
+            assert ka is not None and kb is not None and ka != kb
+            pd.testing.assert_frame_equal(read_df(con, a), con.execute(a).df())
+            pd.testing.assert_frame_equal(read_df(con, b), con.execute(b).df())
+
+        # same-named tables in main and a sample schema have their own versions
+        assert cache.key(con, QUERIES[0]) != cache.key(con, QUERIES[0].replace("FROM ", f"FROM {SAMPLE}."))
+
+        con.close()
+        generate(data, n_creators=300, days=6, seed=8)
+        con = load(tmp_path / "w.duckdb", data, incremental=True)
+        for sql in QUERIES:
+            after, hit = cached(cache, con, sql)
+            assert not hit, sql
+            pd.testing.assert_frame_equal(after, con.execute(sql).df(), obj=sql)
+        assert not before[QUERIES[0]].equals(read_df(con, QUERIES[0]))
+
+        # an incremental load with nothing new keeps every key, so results stay cached
+        con.close()
+        con = load(tmp_path / "w.duckdb", data, incremental=True)
+        assert all(cached(cache, con, sql)[1] for sql in QUERIES)
+    finally:
+        use_result_cache(None)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+import pytest
+from src.utils import sampling
+
+def population(n: int = 6000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    pop = pd.DataFrame({
+        "tier": rng.choice(["Small", "Mid", "Large"], n, p=[0.7, 0.2, 0.1]),
+        "country": rng.choice(["US", "CA"], n),
+        "experiment_group": rng.choice(["control", "treatment"], n),
+    })
+    scale = pop["tier"].map({"Small": 1.0, "Mid": 4.0, "Large": 20.0}).to_numpy()
+    pop["listens"] = rng.gamma(1.5, scale)
+    pop["eligible"] = (rng.random(n) < 0.5).astype(int)
+    pop["enrolled"] = pop["eligible"] * (rng.random(n) < np.where(pop["experiment_group"] == "treatment", 0.4, 0.3))
+    return pop
+
+def estimate(sample: pd.DataFrame, pop: pd.DataFrame) -> pd.DataFrame:
+    n_pop = pop.groupby(sampling.STRATA).size().rename("n_pop")
+    n_sample = sample.groupby(sampling.STRATA).size().rename("n_sample")
+    strata = pd.concat([n_pop, n_sample], axis=1).reset_index()
+    sums = sample.assign(listens_sq=sample["listens"] ** 2)
+    return sampling.estimate(sums, strata, ["experiment_group"], totals={"listens": ("listens", "listens_sq")},
+                             ratios={"rate": ("enrolled", "eligible", None, None, None)})
+
+def truth(pop: pd.DataFrame) -> pd.DataFrame:
+    g = pop.groupby("experiment_group")
+    return pd.DataFrame({"listens": g["listens"].sum(), "rate": g["enrolled"].sum() / g["eligible"].sum()}).reset_index()
+
+def test_census_is_exact_with_zero_width_interval():
+    pop = population()
+    est, want = estimate(pop, pop), truth(pop)
+    for name in ("listens", "rate"):
+        np.testing.assert_allclose(est[name], want[name], rtol=1e-9)
+        np.testing.assert_allclose(est[f"{name}_ci95_low"], est[f"{name}_ci95_high"], rtol=1e-9)
+
+def test_intervals_cover_the_population_value():
+    pop, rng = population(), np.random.default_rng(1)
+    want = truth(pop)
+    covered = {"listens": 0, "rate": 0}
+    reps = 300
+    for _ in range(reps):
+        sample = pop.groupby(sampling.STRATA, group_keys=False).sample(frac=0.1, random_state=rng)
+        est = estimate(sample, pop)
+        for name in covered:
+            covered[name] += int(((est[f"{name}_ci95_low"] <= want[name]) & (want[name] <= est[f"{name}_ci95_high"])).all())
+    # both groups covered together: about 0.95^2 ~ 0.90 of the time
+    for name, k in covered.items():
+        assert k / reps == pytest.approx(0.9, abs=0.06), name
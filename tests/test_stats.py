@@ -0,0 +1,42 @@
+from __future__ import annotations
+import numpy as np
+import pytest
+from sklearn.metrics import roc_auc_score
+from src.utils import stats
+
+@pytest.fixture
+def sample():
+    rng = np.random.default_rng(3)
+    d = rng.poisson(5, 4000) + 1.0
+    y = d * rng.gamma(2.0, 1.5, 4000)
+    x = y / d + rng.normal(0, 1, 4000)
+    return x, y, d
+
+def test_ratio_delta_method_matches_linearization(sample):
+    _, y, d = sample
+    n = len(y)
+    r, var_r = stats.ratio_from_sums(n, y.sum(), (y * y).sum(), d.sum(), (d * d).sum(), (y * d).sum())
+    assert r == pytest.approx(y.sum() / d.sum())
+    # sum(y)/sum(d) is linearized as mean(y - r*d) / mean(d)
+    assert var_r == pytest.approx(np.var(y - r * d, ddof=1) / (n * d.mean() ** 2), rel=1e-9)
+    boot = stats.bootstrap_dist(y, stat="ratio", denom=d, n_boot=2000, seed=1)
+    assert np.sqrt(var_r) == pytest.approx(boot.std(), rel=0.1)
+
+def test_cuped_theta_is_the_regression_slope(sample):
+    x, y, _ = sample
+    theta = stats.cuped_theta(len(x), x.sum(), (x * x).sum(), y.sum(), (x * y).sum())
+    assert theta == pytest.approx(np.polyfit(x, y, 1)[0], rel=1e-9)
+    adjusted = y - theta * (x - x.mean())
+    assert adjusted.var() < y.var()
+
+def test_binned_auc_matches_sklearn_on_binned_scores():
+    rng = np.random.default_rng(5)
+    label = rng.integers(0, 2, 5000)
+    bins = np.clip(np.floor((rng.normal(0, 1, 5000) + label) * 4) + 12, 0, 24).astype(int)
+    pos, neg = (np.bincount(bins[label == v], minlength=25) for v in (1, 0))
+    assert stats.binned_auc(pos, neg) == pytest.approx(roc_auc_score(label, bins), rel=1e-12)
+
+def test_bootstrap_is_independent_of_workers(sample):
+    _, y, d = sample
+    kw = dict(stat="ratio", denom=d, n_boot=500, seed=11, max_block_bytes=1 << 16)
+    np.testing.assert_array_equal(stats.bootstrap_dist(y, **kw), stats.bootstrap_dist(y, workers=4, **kw))